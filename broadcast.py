@@ -0,0 +1,192 @@
+# broadcast.py
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Повертає перцентиль (nearest-rank) для вже відсортованого списку."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Секунди очікування з RetryAfter (PTB повертає int або timedelta залежно від версії)."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# Помилки BadRequest, після яких надсилати в цей чат вже немає сенсу
+PERMANENT_BAD_REQUEST_MARKERS = ('chat not found', 'user not found', 'peer_id_invalid', 'user is deactivated')
+
+
+def is_permanent_delivery_error(error: Exception) -> bool:
+    """
+    True, якщо чат недосяжний назавжди: бот заблокований, користувач видалений, чат не існує.
+    Такі помилки не варто повторювати — отримувача треба прибрати з розсилки.
+    """
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return any(marker in message for marker in PERMANENT_BAD_REQUEST_MARKERS)
+    return False
+
+
+class TokenBucket:
+    """Асинхронний token bucket: `rate` токенів за секунду, не більше `capacity` у запасі."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Лок тримаємо під час очікування, щоб відправники отримували токени по черзі (FIFO)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Зупиняє видачу токенів на `seconds` секунд (для RetryAfter від Telegram)."""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens = 0
+        self._paused_until = max(self._paused_until, now + seconds)
+
+
+class BroadcastStats:
+    """Результат однієї розсилки: лічильники та затримки доставки від старту розсилки."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        # Чати, що відповіли постійною помилкою (is_permanent_delivery_error)
+        self.unreachable: List[int] = []
+        self.latencies: List[float] = []
+        self.duration = 0.0
+
+    def summary(self) -> str:
+        latencies = sorted(self.latencies)
+        p50, p95, p99 = (percentile(latencies, p) for p in (50, 95, 99))
+        fmt = lambda v: f"{v:.2f}s" if v is not None else "n/a"
+        return (f"{self.label}: sent={self.sent} failed={self.failed} unreachable={len(self.unreachable)} "
+                f"retries={self.retries} "
+                f"duration={self.duration:.2f}s latency p50={fmt(p50)} p95={fmt(p95)} p99={fmt(p99)}")
+
+
+class Broadcaster:
+    """
+    Розсилає одне повідомлення багатьом чатам паралельно з дотриманням лімітів Telegram:
+    глобальний token bucket, мінімальний інтервал для кожного чату та адаптивний backoff на RetryAfter.
+    """
+
+    def __init__(self, concurrency: int, global_rate: float, per_chat_rate: float, max_retries: int = 3):
+        self.concurrency = max(1, concurrency)
+        self.target_rate = global_rate
+        self.min_rate = max(1.0, global_rate / 10)
+        self.per_chat_interval = 1.0 / per_chat_rate if per_chat_rate > 0 else 0.0
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(global_rate, capacity=max(1.0, global_rate))
+        self._chat_next_slot: Dict[int, float] = {}
+
+    async def _wait_chat_slot(self, chat_id: int):
+        if not self.per_chat_interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+        self._chat_next_slot[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _on_retry_after(self, seconds: float):
+        # Multiplicative decrease: зменшуємо темп удвічі та ставимо розсилку на паузу
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        self.bucket.pause(seconds)
+        logger.warning(f"Telegram flood control: pausing broadcast for {seconds:.1f}s, "
+                       f"rate lowered to {self.bucket.rate:.1f} msg/s")
+
+    def _on_success(self):
+        # Additive increase: повільно повертаємось до цільового темпу
+        if self.bucket.rate < self.target_rate:
+            self.bucket.rate = min(self.target_rate, self.bucket.rate + 0.1)
+
+    def _prune_chat_slots(self):
+        now = time.monotonic()
+        self._chat_next_slot = {chat_id: slot for chat_id, slot in self._chat_next_slot.items() if slot > now}
+
+    async def _deliver(self, chat_id: int, send: Callable[[int], Awaitable[bool]], stats: BroadcastStats,
+                       started: float):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat_slot(chat_id)
+            await self.bucket.acquire()
+            try:
+                delivered = await send(chat_id)
+            except RetryAfter as e:
+                self._on_retry_after(retry_after_seconds(e))
+                if attempt < self.max_retries:
+                    stats.retries += 1
+                    continue
+                logger.error(f"Giving up on chat {chat_id} after {attempt + 1} flood-control retries.")
+                delivered = False
+            except Exception as e:
+                if is_permanent_delivery_error(e):
+                    stats.unreachable.append(chat_id)
+                    return
+                logger.error(f"Unhandled exception while broadcasting to {chat_id}: {e}")
+                delivered = False
+
+            if delivered:
+                stats.sent += 1
+                stats.latencies.append(time.monotonic() - started)
+                self._on_success()
+            else:
+                stats.failed += 1
+            return
+
+    async def broadcast(self, chat_ids: Iterable[int], send: Callable[[int], Awaitable[bool]],
+                        label: str = "broadcast") -> BroadcastStats:
+        """
+        Викликає `send(chat_id)` для кожного чату, не більше `concurrency` одночасно.
+        `send` повертає True при успішній доставці; RetryAfter обробляється тут, а чати з постійними
+        помилками (див. is_permanent_delivery_error) потрапляють у `stats.unreachable`.
+        """
+        stats = BroadcastStats(label)
+        started = time.monotonic()
+        chat_iter = iter(chat_ids)
+
+        async def worker():
+            for chat_id in chat_iter:
+                await self._deliver(chat_id, send, stats, started)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        stats.duration = time.monotonic() - started
+        self._prune_chat_slots()
+        return stats
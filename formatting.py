@@ -0,0 +1,50 @@
+# formatting.py
+from string import Formatter
+from typing import Dict
+
+from i18n import CATALOG
+
+MARKDOWN_V2_SPECIAL_CHARS = r'\_*[]()~`>#+-=|{}.!'
+_MARKDOWN_V2_ESCAPE_TABLE = str.maketrans({ch: '\\' + ch for ch in MARKDOWN_V2_SPECIAL_CHARS})
+
+
+def escape_markdown_v2(text) -> str:
+    """Екранує спеціальні символи для Telegram MarkdownV2."""
+    return str(text).translate(_MARKDOWN_V2_ESCAPE_TABLE)
+
+
+class MarkdownTemplate:
+    """
+    Шаблон для MarkdownV2, скомпільований один раз: статичний текст екранується при створенні
+    (якщо `escape_static`; для шаблонів, уже екранованих вручну в i18n, — ні),
+    а під час рендеру екрануються лише підставлені значення.
+    """
+
+    def __init__(self, template: str, escape_static: bool = True):
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if escape_static:
+                literal = escape_markdown_v2(literal)
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is not None:
+                parts.append('{' + field + ('!' + conversion if conversion else '') + (':' + spec if spec else '') + '}')
+        self._format = ''.join(parts).format
+
+    def render(self, **fields) -> str:
+        return self._format(**{name: escape_markdown_v2(value) for name, value in fields.items()})
+
+
+class ListingTemplates:
+    """Усе статичне для рендеру оголошення однією мовою, підготовлене при імпорті."""
+
+    def __init__(self, lang: str):
+        entries = CATALOG[lang]
+        # Заголовок і тіло в i18n записані як звичайний текст — екрануємо їх тут
+        self.title = MarkdownTemplate(entries['new_listing_title'])
+        self.body = MarkdownTemplate(entries['new_listing_body'])
+        self.not_specified = entries['not_specified']
+        self.view_button = entries['view_listing_button']
+        self.view_button_escaped = escape_markdown_v2(self.view_button)
+
+
+LISTING_TEMPLATES: Dict[str, ListingTemplates] = {lang: ListingTemplates(lang) for lang in CATALOG}
@@ -1,4 +1,8 @@
 # i18n.py
+from string import Formatter
+from typing import Dict, Set
+
+DEFAULT_LANGUAGE = 'en'
 
 TRANSLATIONS = {
     'uk': {
@@ -31,6 +35,24 @@ TRANSLATIONS = {
         'settings_enable_tracker': "🛰️ Увімкнути трекінг посилань",
         'settings_disable_tracker': "🛰️ Вимкнути трекінг посилань",
         'tracker_status_changed_alert': "✅ Статус трекінгу оновлено!",
+
+        # --- Фільтри ---
+        'settings_filters': "🔎 Фільтри оголошень",
+        'filters_menu_title': "🔎 **Фільтри оголошень**\n\nСповіщення надходитимуть лише про оголошення, що відповідають усім заданим фільтрам\\.\n\n🏙 Місто: {cities}\n📮 Поштовий індекс: {postcodes}\n💰 Ціна: {price}",
+        'filter_any': "без обмежень",
+        'filter_price_between': "{min_price}–{max_price} €",
+        'filter_price_from': "від {min_price} €",
+        'filter_price_up_to': "до {max_price} €",
+        'filter_set_city': "🏙 Місто",
+        'filter_set_postcode': "📮 Поштовий індекс",
+        'filter_set_price': "💰 Ціна",
+        'filter_reset': "🧹 Скинути фільтри",
+        'back_to_filters': "⬅️ Назад до фільтрів",
+        'filter_prompt_city': "🏙 Надішліть назву міста або кілька через кому, напр\\. `Eindhoven, Helmond`\\.\n\nНадішліть `-`, щоб прибрати цей фільтр\\.",
+        'filter_prompt_postcode': "📮 Надішліть початок поштового індексу або кілька через кому, напр\\. `56, 5701`\\.\n\nНадішліть `-`, щоб прибрати цей фільтр\\.",
+        'filter_prompt_price': "💰 Надішліть діапазон ціни в євро, напр\\. `800-1400`, `-1200` \\(до\\) або `900-` \\(від\\)\\.\n\nНадішліть `-`, щоб прибрати цей фільтр\\.",
+        'filter_invalid': "⚠️ Не вдалося розпізнати значення\\. Спробуйте ще раз або поверніться до фільтрів\\.",
+        'filters_reset_alert': "✅ Фільтри скинуто!",
         
         # --- Мова ---
         'lang_menu_title': "🌐 **Оберіть мову**",
@@ -102,6 +124,24 @@ TRANSLATIONS = {
         'settings_enable_tracker': "🛰️ Enable link tracking",
         'settings_disable_tracker': "🛰️ Disable link tracking",
         'tracker_status_changed_alert': "✅ Tracking status updated!",
+
+        # --- Filters ---
+        'settings_filters': "🔎 Listing filters",
+        'filters_menu_title': "🔎 **Listing filters**\n\nYou will only be notified about listings that match all the filters you set\\.\n\n🏙 City: {cities}\n📮 Postcode: {postcodes}\n💰 Price: {price}",
+        'filter_any': "any",
+        'filter_price_between': "{min_price}–{max_price} €",
+        'filter_price_from': "from {min_price} €",
+        'filter_price_up_to': "up to {max_price} €",
+        'filter_set_city': "🏙 City",
+        'filter_set_postcode': "📮 Postcode",
+        'filter_set_price': "💰 Price",
+        'filter_reset': "🧹 Reset filters",
+        'back_to_filters': "⬅️ Back to filters",
+        'filter_prompt_city': "🏙 Send a city name, or several separated by commas, e\\.g\\. `Eindhoven, Helmond`\\.\n\nSend `-` to remove this filter\\.",
+        'filter_prompt_postcode': "📮 Send the beginning of a postcode, or several separated by commas, e\\.g\\. `56, 5701`\\.\n\nSend `-` to remove this filter\\.",
+        'filter_prompt_price': "💰 Send a price range in euros, e\\.g\\. `800-1400`, `-1200` \\(up to\\) or `900-` \\(from\\)\\.\n\nSend `-` to remove this filter\\.",
+        'filter_invalid': "⚠️ Could not understand that value\\. Try again or go back to the filters\\.",
+        'filters_reset_alert': "✅ Filters reset!",
         
         # --- Language ---
         'lang_menu_title': "🌐 **Choose a language**",
@@ -173,6 +213,24 @@ TRANSLATIONS = {
         'settings_enable_tracker': "🛰️ Link tracking inschakelen",
         'settings_disable_tracker': "🛰️ Link tracking uitschakelen",
         'tracker_status_changed_alert': "✅ Trackingstatus bijgewerkt!",
+
+        # --- Filters ---
+        'settings_filters': "🔎 Advertentiefilters",
+        'filters_menu_title': "🔎 **Advertentiefilters**\n\nJe ontvangt alleen meldingen over advertenties die aan alle ingestelde filters voldoen\\.\n\n🏙 Stad: {cities}\n📮 Postcode: {postcodes}\n💰 Prijs: {price}",
+        'filter_any': "geen filter",
+        'filter_price_between': "{min_price}–{max_price} €",
+        'filter_price_from': "vanaf {min_price} €",
+        'filter_price_up_to': "tot {max_price} €",
+        'filter_set_city': "🏙 Stad",
+        'filter_set_postcode': "📮 Postcode",
+        'filter_set_price': "💰 Prijs",
+        'filter_reset': "🧹 Filters wissen",
+        'back_to_filters': "⬅️ Terug naar filters",
+        'filter_prompt_city': "🏙 Stuur een plaatsnaam, of meerdere gescheiden door komma's, bijv\\. `Eindhoven, Helmond`\\.\n\nStuur `-` om dit filter te verwijderen\\.",
+        'filter_prompt_postcode': "📮 Stuur het begin van een postcode, of meerdere gescheiden door komma's, bijv\\. `56, 5701`\\.\n\nStuur `-` om dit filter te verwijderen\\.",
+        'filter_prompt_price': "💰 Stuur een prijsbereik in euro, bijv\\. `800-1400`, `-1200` \\(tot\\) of `900-` \\(vanaf\\)\\.\n\nStuur `-` om dit filter te verwijderen\\.",
+        'filter_invalid': "⚠️ Deze waarde wordt niet herkend\\. Probeer het opnieuw of ga terug naar de filters\\.",
+        'filters_reset_alert': "✅ Filters gewist!",
         
         # --- Taal ---
         'lang_menu_title': "🌐 **Kies een taal**",
@@ -214,4 +272,52 @@ TRANSLATIONS = {
             "De bot controleert elke {interval} seconden op nieuwe advertenties\\."
         ),
     }
-}
\ No newline at end of file
+}
+
+
+def _placeholders(lang: str, key: str, text: str) -> Set[str]:
+    try:
+        return {field for _, field, _, _ in Formatter().parse(text) if field is not None}
+    except ValueError as e:
+        raise ValueError(f"i18n: malformed template {lang}.{key}: {e}") from None
+
+
+def compile_catalog(translations: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    """
+    Повний словник для кожної мови: відсутні (або порожні) ключі вже заповнені з DEFAULT_LANGUAGE.
+    Перевіряє шаблони: відомі ключі, коректні дужки та ті самі плейсхолдери, що й у DEFAULT_LANGUAGE.
+    """
+    base = translations[DEFAULT_LANGUAGE]
+    base_fields = {key: _placeholders(DEFAULT_LANGUAGE, key, text) for key, text in base.items()}
+    catalog = {}
+    for lang, entries in translations.items():
+        unknown = entries.keys() - base.keys()
+        if unknown:
+            raise ValueError(f"i18n: keys {sorted(unknown)} in '{lang}' are missing from '{DEFAULT_LANGUAGE}'")
+        merged = {**base, **{key: text for key, text in entries.items() if text}}
+        for key, text in merged.items():
+            fields = _placeholders(lang, key, text)
+            if fields != base_fields[key]:
+                raise ValueError(f"i18n: {lang}.{key} uses placeholders {sorted(fields)}, "
+                                 f"expected {sorted(base_fields[key])}")
+        catalog[lang] = merged
+    return catalog
+
+
+def build_reverse_index(catalog: Dict[str, Dict[str, str]], keys) -> Dict[str, str]:
+    """Підпис будь-якою мовою -> ключ. Однаковий підпис для різних ключів — помилка."""
+    index = {}
+    for lang, entries in catalog.items():
+        for key in keys:
+            label = entries[key]
+            if index.setdefault(label, key) != key:
+                raise ValueError(f"i18n: label {label!r} ({lang}.{key}) is also used for '{index[label]}'")
+    return index
+
+
+# Компілюється при імпорті: помилки в перекладах зупиняють запуск, а не ламають відповідь користувачу
+CATALOG = compile_catalog(TRANSLATIONS)
+
+# Кнопки головного меню (ReplyKeyboard): бот отримує лише текст натиснутої кнопки
+MENU_BUTTON_KEYS = ('main_menu_view_listings', 'main_menu_donate', 'main_menu_settings', 'main_menu_help')
+MENU_BUTTON_ACTIONS = build_reverse_index(CATALOG, MENU_BUTTON_KEYS)
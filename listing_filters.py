@@ -0,0 +1,213 @@
+# listing_filters.py
+import re
+from bisect import bisect_right, insort
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+MAX_FILTER_VALUES = 10
+MAX_CITY_LENGTH = 64
+# Нідерландський індекс: 4 цифри + 2 літери; префікс — будь-який його початок
+_POSTCODE_PREFIX_RE = re.compile(r'^\d{1,4}([A-Z]{1,2})?$')
+_PRICE_RANGE_RE = re.compile(r'^(\d*)\s*-\s*(\d*)$')
+
+
+def normalize_city(city) -> str:
+    return ' '.join(str(city).split()).casefold()
+
+
+def normalize_postcode(postcode) -> str:
+    return ''.join(str(postcode).split()).upper()
+
+
+def _split_values(text: str) -> List[str]:
+    values = list(dict.fromkeys(value.strip() for value in text.split(',') if value.strip()))
+    if not values or len(values) > MAX_FILTER_VALUES:
+        raise ValueError(text)
+    return values
+
+
+def parse_cities(text: str) -> List[str]:
+    """'Eindhoven, Helmond' -> ['Eindhoven', 'Helmond'] (як ввів користувач; порівняння — без регістру)."""
+    cities = [' '.join(city.split()) for city in _split_values(text)]
+    if any(len(city) > MAX_CITY_LENGTH for city in cities):
+        raise ValueError(text)
+    return cities
+
+
+def parse_postcode_prefixes(text: str) -> List[str]:
+    """'56, 5701 ab' -> ['56', '5701AB']."""
+    prefixes = list(dict.fromkeys(normalize_postcode(value) for value in _split_values(text)))
+    if not all(_POSTCODE_PREFIX_RE.match(prefix) for prefix in prefixes):
+        raise ValueError(text)
+    return prefixes
+
+
+def parse_price_range(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """'800-1400' -> (800, 1400), '-1200' -> (None, 1200), '900-' або '900' -> (900, None)."""
+    text = text.strip().replace('–', '-').replace('€', '').replace(' ', '')
+    match = _PRICE_RANGE_RE.match(text) if '-' in text else re.match(r'^(\d+)()$', text)
+    if not match or not any(match.groups()):
+        raise ValueError(text)
+    min_price, max_price = (int(value) if value else None for value in match.groups())
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise ValueError(text)
+    return min_price, max_price
+
+
+class ListingFilter:
+    """Фільтри одного користувача. Порожнє поле — без обмеження; оголошення має пройти всі задані поля."""
+
+    FIELDS = ('cities', 'postcode_prefixes', 'min_price', 'max_price')
+    __slots__ = FIELDS + ('city_keys',)
+
+    def __init__(self, cities: Iterable[str] = (), postcode_prefixes: Iterable[str] = (),
+                 min_price: Optional[int] = None, max_price: Optional[int] = None):
+        self.cities = tuple(cities)
+        self.postcode_prefixes = tuple(postcode_prefixes)
+        self.min_price = min_price
+        self.max_price = max_price
+        self.city_keys = frozenset(normalize_city(city) for city in self.cities)
+
+    @classmethod
+    def from_row(cls, row) -> 'ListingFilter':
+        return cls(row['cities'].split(',') if row['cities'] else (),
+                   row['postcode_prefixes'].split(',') if row['postcode_prefixes'] else (),
+                   row['min_price'], row['max_price'])
+
+    def to_row(self) -> Tuple[Optional[str], Optional[str], Optional[int], Optional[int]]:
+        return (','.join(self.cities) or None, ','.join(self.postcode_prefixes) or None,
+                self.min_price, self.max_price)
+
+    def replace(self, **changes) -> 'ListingFilter':
+        fields = {name: getattr(self, name) for name in self.FIELDS}
+        fields.update(changes)
+        return ListingFilter(**fields)
+
+    def is_empty(self) -> bool:
+        return not self.cities and not self.postcode_prefixes and self.min_price is None and self.max_price is None
+
+    def has_price_range(self) -> bool:
+        return self.min_price is not None or self.max_price is not None
+
+    def matches_city(self, city_key: Optional[str]) -> bool:
+        return not self.cities or city_key is None or city_key in self.city_keys
+
+    def matches_postcode(self, postcode: Optional[str]) -> bool:
+        return not self.postcode_prefixes or postcode is None or postcode.startswith(self.postcode_prefixes)
+
+    def matches_price(self, price: Optional[float]) -> bool:
+        if price is None:
+            return True
+        return (self.min_price is None or price >= self.min_price) and \
+            (self.max_price is None or price <= self.max_price)
+
+
+def _listing_price(listing: Dict) -> Optional[float]:
+    try:
+        return float(listing['base_price']) if listing.get('base_price') is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ListingFilterIndex:
+    """
+    Інвертований індекс фільтрів: місто -> користувачі, префікс індексу -> користувачі,
+    відсортовані межі цін. У індексі лише користувачі з хоча б одним фільтром — решта отримує все.
+
+    match() бере найвибірковіший вимір (розміри відомі з довжин множин і одного bisect), і лише його
+    кандидатів перевіряє за іншими вимірами, тож вартість пропорційна кількості кандидатів, а не користувачів.
+    Якщо в оголошенні немає значення виміру, цей вимір його не відсікає.
+    """
+
+    def __init__(self):
+        self._filters: Dict[int, ListingFilter] = {}
+        self._by_city: Dict[str, Set[int]] = {}
+        self._any_city: Set[int] = set()
+        self._by_postcode_prefix: Dict[str, Set[int]] = {}
+        self._any_postcode: Set[int] = set()
+        # (min_price, user_id) зростаюче; відсутня нижня межа — 0
+        self._price_floors: List[Tuple[float, int]] = []
+        self._any_price: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._filters
+
+    def get(self, user_id: int) -> Optional[ListingFilter]:
+        return self._filters.get(user_id)
+
+    def set(self, user_id: int, listing_filter: Optional[ListingFilter]):
+        self.discard(user_id)
+        if listing_filter is None or listing_filter.is_empty():
+            return
+        self._filters[user_id] = listing_filter
+        for city_key in listing_filter.city_keys:
+            self._by_city.setdefault(city_key, set()).add(user_id)
+        if not listing_filter.cities:
+            self._any_city.add(user_id)
+        for prefix in listing_filter.postcode_prefixes:
+            self._by_postcode_prefix.setdefault(prefix, set()).add(user_id)
+        if not listing_filter.postcode_prefixes:
+            self._any_postcode.add(user_id)
+        if listing_filter.has_price_range():
+            insort(self._price_floors, (listing_filter.min_price or 0, user_id))
+        else:
+            self._any_price.add(user_id)
+
+    def discard(self, user_id: int):
+        listing_filter = self._filters.pop(user_id, None)
+        if listing_filter is None:
+            return
+        for city_key in listing_filter.city_keys:
+            self._discard_from(self._by_city, city_key, user_id)
+        for prefix in listing_filter.postcode_prefixes:
+            self._discard_from(self._by_postcode_prefix, prefix, user_id)
+        self._any_city.discard(user_id)
+        self._any_postcode.discard(user_id)
+        self._any_price.discard(user_id)
+        if listing_filter.has_price_range():
+            self._price_floors.remove((listing_filter.min_price or 0, user_id))
+
+    @staticmethod
+    def _discard_from(index: Dict[str, Set[int]], key: str, user_id: int):
+        users = index.get(key)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del index[key]
+
+    def match(self, listing: Dict) -> Set[int]:
+        """Користувачі з фільтрами, яким підходить оголошення."""
+        if not self._filters:
+            return set()
+        city_key = normalize_city(listing['city']) if listing.get('city') else None
+        postcode = normalize_postcode(listing['postcode']) if listing.get('postcode') else None
+        price = _listing_price(listing)
+
+        # Кожен вимір — (кількість кандидатів, множини, об'єднання яких містить усіх, хто проходить цей вимір)
+        dimensions = []
+        if city_key is not None:
+            by_city = self._by_city.get(city_key, ())
+            dimensions.append((len(self._any_city) + len(by_city), [self._any_city, by_city]))
+        if postcode is not None:
+            by_prefix = [self._by_postcode_prefix.get(postcode[:i], ()) for i in range(1, len(postcode) + 1)]
+            dimensions.append((len(self._any_postcode) + sum(map(len, by_prefix)), [self._any_postcode] + by_prefix))
+        if price is not None:
+            # Кандидати за ціною — ті, чия нижня межа не вища за ціну; верхню межу перевіряє matches_price
+            floors = bisect_right(self._price_floors, (price, float('inf')))
+            dimensions.append((len(self._any_price) + floors,
+                               [self._any_price, (user_id for _, user_id in islice(self._price_floors, floors))]))
+        if not dimensions:
+            return set(self._filters)
+
+        _, driving = min(dimensions, key=lambda dimension: dimension[0])
+        matched = set()
+        for users in driving:
+            for user_id in users:
+                listing_filter = self._filters[user_id]
+                if listing_filter.matches_city(city_key) and listing_filter.matches_postcode(postcode) \
+                        and listing_filter.matches_price(price):
+                    matched.add(user_id)
+        return matched
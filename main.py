@@ -1,18 +1,20 @@
 # main.py
-import requests
+import httpx
 import time
 import os
 import logging
 import colorlog
 from colorlog import ColoredFormatter
 import sys
-import sqlite3
-import re
+import queue
 import asyncio
+import secrets
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Tuple
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 
 import telegram
@@ -23,7 +25,14 @@ from telegram.ext import (
 )
 
 # Імпортуємо локалізацію з окремого файлу
-from i18n import TRANSLATIONS
+from i18n import CATALOG, DEFAULT_LANGUAGE, MENU_BUTTON_ACTIONS, TRANSLATIONS
+from formatting import LISTING_TEMPLATES, escape_markdown_v2
+from broadcast import Broadcaster, is_permanent_delivery_error
+from update_processor import PerUserUpdateProcessor
+from visibility import ListingVisibilityIndex
+from storage import format_timestamp, open_storage
+from listing_filters import (ListingFilter, ListingFilterIndex, parse_cities, parse_postcode_prefixes,
+                             parse_price_range)
 
 
 
@@ -34,17 +43,83 @@ TRACKER_BASE_URL = os.environ.get("TRACKER_BASE_URL", "")
 
 LOG_FILE_PATH = os.environ.get("LOG_FILE_PATH", "/var/log/whx.log")
 DATABASE_PATH = os.environ.get("DATABASE_PATH", "")
+# sqlite:///шлях або postgresql://...; якщо не задано — SQLite-файл DATABASE_PATH
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
 API_URL = os.environ.get("API_URL", "")
 BASE_URL = os.environ.get("BASE_URL", "")
 IMAGE_BASE_URL = os.environ.get("IMAGE_BASE_URL", "")
 
 TRACKER_HEALTH_CHECK_INTERVAL = int(os.environ.get("TRACKER_HEALTH_CHECK_INTERVAL", "60"))
 
+# HTTP-клієнт для API оголошень та перевірки трекера (спільний пул keep-alive з'єднань)
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "10"))
+API_PAGE_SIZE = int(os.environ.get("API_PAGE_SIZE", "100"))
+API_FETCH_CONCURRENCY = int(os.environ.get("API_FETCH_CONCURRENCY", "4"))
+# Повтори запиту сторінки після тайм-ауту, розриву з'єднання або 429/5xx: затримка API_RETRY_DELAY * 2^спроба
+API_RETRIES = int(os.environ.get("API_RETRIES", "2"))
+API_RETRY_DELAY = float(os.environ.get("API_RETRY_DELAY", "2.0"))
+
+# Режим вебхука: якщо WEBHOOK_URL задано (публічна https-адреса), оновлення Telegram приходять
+# на ASGI-застосунок трекера, і бот з трекером працюють в одному процесі замість long polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
 CHECK_INTERVAL = int(os.environ.get("CHECK_INTERVAL", "60"))
 NETHERLANDS_TZ = ZoneInfo("Europe/Amsterdam")
 LISTINGS_PER_PAGE = int(os.environ.get("LISTINGS_PER_PAGE", "5"))
 HIGHLIGHT_DAYS_THRESHOLD = int(os.environ.get("HIGLIGHT_DAYS_THRESHOLD", "2"))
 
+# Розсилка: Telegram дозволяє ~30 повідомлень/с глобально та ~1 повідомлення/с в один чат
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_GLOBAL_RATE = float(os.environ.get("BROADCAST_GLOBAL_RATE", "25"))
+BROADCAST_PER_CHAT_RATE = float(os.environ.get("BROADCAST_PER_CHAT_RATE", "1"))
+BROADCAST_MAX_RETRIES = int(os.environ.get("BROADCAST_MAX_RETRIES", "3"))
+
+# Скільки оновлень Telegram обробляється одночасно (оновлення одного користувача — завжди по черзі)
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "64"))
+
+# Пул з'єднань з БД (SQLite або PostgreSQL)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+DB_CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "256"))
+
+# Кеш профілів користувачів (мова, часовий пояс, трекінг, підписка).
+# TTL потрібен, бо часовий пояс записує tracker.py з іншого процесу.
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+# Кеш відрендерених сторінок переглядача оголошень
+LISTINGS_PAGE_CACHE_SIZE = int(os.environ.get("LISTINGS_PAGE_CACHE_SIZE", "512"))
+LISTINGS_PAGE_CACHE_TTL = int(os.environ.get("LISTINGS_PAGE_CACHE_TTL", "300"))
+RECENT_LISTINGS_DAYS = 3
+
+# Скільки розібраних дат і відформатованих пар (дата, часовий пояс) тримати в пам'яті
+DATE_CACHE_SIZE = int(os.environ.get("DATE_CACHE_SIZE", "4096"))
+# Кеш ZoneInfo за назвою: назву пише /set_tz трекера з будь-яким рядком, тож кеш (разом з промахами) обмежений
+ZONE_CACHE_SIZE = 1024
+
+# Черга доставки (outbox): сповіщення (оголошення, користувач) зберігаються в БД разом з оголошенням
+# і доставляються пачками; після падіння процесу доставка продовжується з того ж місця
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = int(os.environ.get("OUTBOX_POLL_INTERVAL", "15"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_DELAY = int(os.environ.get("OUTBOX_RETRY_DELAY", "60"))
+OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", "14"))
+# Завдання, що пробуло в 'sending' довше, вважається покинутим (помилка посеред проходу) і забирається знову
+OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", "600"))
+# Результати доставки пишуться в БД пачками: коли набралось OUTBOX_FLUSH_SIZE записів,
+# минуло OUTBOX_FLUSH_INTERVAL секунд або закінчилась розсилка оголошення
+OUTBOX_FLUSH_SIZE = int(os.environ.get("OUTBOX_FLUSH_SIZE", "100"))
+OUTBOX_FLUSH_INTERVAL = float(os.environ.get("OUTBOX_FLUSH_INTERVAL", "2.0"))
+# Скільки разів повторити запис результатів наприкінці розсилки, якщо БД тимчасово недоступна
+OUTBOX_FLUSH_RETRIES = int(os.environ.get("OUTBOX_FLUSH_RETRIES", "5"))
+
+# Фрагменти помилок Telegram, які означають, що саме зображення не вдалося отримати чи обробити
+PHOTO_ERROR_MARKERS = ('http url', 'file identifier', 'web page content', 'image_process_failed', 'photo_invalid')
+
 
 # --- Налаштування логування ---
 
@@ -83,75 +158,130 @@ logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
 
-def escape_markdown_v2(text: str) -> str:
-    """Екранує спеціальні символи для Telegram MarkdownV2."""
-    escape_chars = r'\_*[]()~`>#+-=|{}.!'
-    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', str(text))
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_iso_datetime(value: str) -> datetime:
+    # Ті самі publication_date/closing_date розбираються для кожної сторінки та кожного отримувача
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+@lru_cache(maxsize=ZONE_CACHE_SIZE)
+def get_zone(tz_name: str) -> Optional[ZoneInfo]:
+    """ZoneInfo за назвою (None для невідомої)."""
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def format_local_datetime(date_str: str, user_tz: ZoneInfo) -> str:
+    return parse_iso_datetime(date_str).astimezone(user_tz).strftime('%d.%m.%Y %H:%M')
 
 
 class DatabaseManager:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+    def __init__(self, database_url: str, pool_size: int = DB_POOL_SIZE):
+        # SQLite (шлях або sqlite:///...) чи PostgreSQL (postgresql://...) — див. storage.py
+        self.storage = open_storage(database_url, cached_statements=DB_CACHED_STATEMENTS)
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=max(1, pool_size))
+        self.connections_opened = 0
+        self._profiles: OrderedDict = OrderedDict()
+        # Множина вже відомих url_key; processed_urls пише лише бот, тож вона завжди синхронна з таблицею
+        self._known_url_keys: Optional[set] = None
+        # Оголошення переглядів 'recent'/'active' у пам'яті; завантажується при першому зверненні
+        self._visibility: Optional[ListingVisibilityIndex] = None
+        # Фільтри підписки (лише користувачі, що їх задали); завантажується при першому зверненні
+        self._listing_filters: Optional[ListingFilterIndex] = None
         self.init_database()
 
+    def _create_connection(self):
+        conn = self.storage.connect()
+        self.connections_opened += 1
+        return conn
+
     @contextmanager
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path, timeout=15.0)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=WAL")
+        # Беремо з'єднання з пулу (LIFO — найтепліше, з прогрітим кешем запитів) або відкриваємо нове
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._create_connection()
         try:
             yield conn
         finally:
-            conn.close()
+            # Не повертаємо в пул з'єднання з незавершеною транзакцією або розірване (перезапуск сервера БД)
+            if conn.in_transaction:
+                conn.rollback()
+            if not self.storage.is_open(conn):
+                return
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """З'єднання для кількох запитів в одній транзакції: commit при успіху, rollback при помилці."""
+        with self.get_db_connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
 
     def init_database(self):
         with self.get_db_connection() as conn:
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    language TEXT DEFAULT 'en',
-                    is_active BOOLEAN DEFAULT TRUE,
-                    timezone TEXT,
-                    use_tracker BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [info['name'] for info in cursor.fetchall()]
-            if 'use_tracker' not in columns:
-                conn.execute("ALTER TABLE users ADD COLUMN use_tracker BOOLEAN DEFAULT TRUE")
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS processed_urls (id INTEGER PRIMARY KEY AUTOINCREMENT, url_key TEXT UNIQUE NOT NULL, full_url TEXT NOT NULL, postcode TEXT, city TEXT, street TEXT, houseNumber TEXT, base_price INTEGER, publication_date TEXT, closing_date TEXT, image_url TEXT, processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS sent_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, url_key TEXT, sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (user_id), FOREIGN KEY (url_key) REFERENCES processed_urls (url_key))
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS donations (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, amount INTEGER, currency TEXT, telegram_charge_id TEXT UNIQUE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, FOREIGN KEY (user_id) REFERENCES users (user_id))
-            ''')
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS url_clicks (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, url_key TEXT, clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, user_agent TEXT, FOREIGN KEY (user_id) REFERENCES users (user_id), FOREIGN KEY (url_key) REFERENCES processed_urls (url_key))
-            ''')
-            conn.commit()
-            logger.info("База даних ініціалізована")
+            self.storage.init_schema(conn)
+            logger.info(f"База даних ініціалізована ({self.storage.name})")
 
-    def get_user_tracker_preference(self, user_id: int) -> bool:
+    def _load_user_profile(self, user_id: int) -> Dict:
         with self.get_db_connection() as conn:
-            cursor = conn.execute("SELECT use_tracker FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            # Повертаємо True, якщо колонка не існує (зворотна сумісність) або якщо вона True
-            return result['use_tracker'] if result and result['use_tracker'] is not None else True
+            cursor = conn.execute("SELECT language, timezone, use_tracker, is_active FROM users WHERE user_id = ?",
+                                  (user_id,))
+            return self.profile_from_row(cursor.fetchone())
+
+    @staticmethod
+    def profile_from_row(result) -> Dict:
+        """Нормалізує рядок users (або його частину) у профіль: перевірена мова, ZoneInfo, значення за замовчуванням."""
+        tz_name = result['timezone'] if result else None
+        user_tz = get_zone(tz_name) if tz_name else None
+        return {
+            'language': result['language'] if result and result['language'] in TRANSLATIONS else 'en',
+            'timezone': user_tz,
+            # True, якщо колонка не існує (зворотна сумісність) або якщо вона True
+            'use_tracker': result['use_tracker'] if result and result['use_tracker'] is not None else True,
+            'is_active': result['is_active'] if result else False,
+        }
+
+    def get_user_profile(self, user_id: int) -> Dict:
+        """Профіль користувача з in-process кешу; з БД читається не частіше ніж раз на USER_CACHE_TTL."""
+        now = time.monotonic()
+        cached = self._profiles.get(user_id)
+        if cached and cached[0] > now:
+            self._profiles.move_to_end(user_id)
+            return cached[1]
+        profile = self._load_user_profile(user_id)
+        self._profiles[user_id] = (now + USER_CACHE_TTL, profile)
+        self._profiles.move_to_end(user_id)
+        if len(self._profiles) > USER_CACHE_SIZE:
+            self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate_user_profile(self, user_id: int):
+        self._profiles.pop(user_id, None)
+
+    def get_user_tracker_preference(self, user_id: int) -> bool:
+        return self.get_user_profile(user_id)['use_tracker']
 
     def set_user_tracker_preference(self, user_id: int, use_tracker: bool):
         with self.get_db_connection() as conn:
             conn.execute("UPDATE users SET use_tracker = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
                          (use_tracker, user_id))
             conn.commit()
+        self.invalidate_user_profile(user_id)
 
     def add_or_get_user(self, user_id: int, username: str = None, first_name: str = None,
                         language_code: str = 'en') -> Dict:
@@ -174,64 +304,166 @@ class DatabaseManager:
                 (user_id, username, first_name, user_lang)
             )
             conn.commit()
+            self.invalidate_user_profile(user_id)
             cursor = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
             return dict(cursor.fetchone())
 
-    # ВИПРАВЛЕНО: Повернуто відсутній метод
-    def is_url_processed(self, url_key: str) -> bool:
-        with self.get_db_connection() as conn:
-            return conn.execute('SELECT 1 FROM processed_urls WHERE url_key = ?', (url_key,)).fetchone() is not None
+    def _get_known_url_keys(self) -> set:
+        if self._known_url_keys is None:
+            with self.get_db_connection() as conn:
+                self._known_url_keys = {row['url_key'] for row in conn.execute('SELECT url_key FROM processed_urls')}
+        return self._known_url_keys
+
+    def filter_new_url_keys(self, url_keys: List[str]) -> List[str]:
+        """Повертає ще не оброблені ключі (без дублікатів, у вихідному порядку) без звернення до БД."""
+        known = self._get_known_url_keys()
+        return [key for key in dict.fromkeys(url_keys) if key not in known]
 
     def get_user_language(self, user_id: int) -> str:
-        with self.get_db_connection() as conn:
-            cursor = conn.execute("SELECT language FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result['language'] if result and result['language'] in TRANSLATIONS else 'en'
+        return self.get_user_profile(user_id)['language']
 
     def set_user_language(self, user_id: int, lang_code: str):
         with self.get_db_connection() as conn:
             conn.execute("UPDATE users SET language = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
                          (lang_code, user_id))
             conn.commit()
+        self.invalidate_user_profile(user_id)
 
     def set_user_active(self, user_id: int, is_active: bool):
         with self.get_db_connection() as conn:
-            conn.execute("UPDATE users SET is_active = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+            conn.execute("UPDATE users SET is_active = ?, blocked_at = NULL, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
                          (is_active, user_id))
             conn.commit()
+        self.invalidate_user_profile(user_id)
+
+    def deactivate_unreachable_users(self, user_ids: List[int]):
+        """Відписує пачку недосяжних користувачів і скасовує їхні ще не доставлені сповіщення."""
+        if not user_ids:
+            return
+        rows = [(user_id,) for user_id in user_ids]
+        with self.transaction() as conn:
+            conn.executemany("UPDATE users SET is_active = FALSE, blocked_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+                             rows)
+            conn.executemany("UPDATE outbox SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE user_id = ? AND status IN ('pending', 'sending')",
+                             rows)
+        for user_id in user_ids:
+            self.invalidate_user_profile(user_id)
 
     def get_user_status(self, user_id: int) -> bool:
-        with self.get_db_connection() as conn:
-            cursor = conn.execute("SELECT is_active FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result['is_active'] if result else False
+        return self.get_user_profile(user_id)['is_active']
 
-    def get_active_users(self) -> List[Dict]:
+    def has_active_users(self) -> bool:
+        """Перевірка за індексом idx_users_active: без читання рядків users і без матеріалізації списку."""
         with self.get_db_connection() as conn:
-            cursor = conn.execute('SELECT * FROM users WHERE is_active = TRUE')
-            return [dict(row) for row in cursor.fetchall()]
-
-    def get_user_timezone(self, user_id: int) -> Optional[ZoneInfo]:
+            return bool(conn.execute('SELECT EXISTS (SELECT 1 FROM users WHERE is_active = TRUE) AS has_active').fetchone()['has_active'])
+
+    def add_processed_urls(self, listings: List[Dict]):
+        """
+        Зберігає пачку оголошень однією транзакцією (один commit/fsync на всю сторінку) і в тій самій
+        транзакції ставить у outbox сповіщення про них для активних користувачів: без фільтрів — усім
+        одним INSERT ... SELECT, з фільтрами — лише тим, кого повернув індекс фільтрів.
+        """
+        if not listings:
+            return
+        listing_filters = self.listing_filters
+        filtered_jobs = [(listing['url_key'], user_id) for listing in listings
+                         for user_id in sorted(listing_filters.match(listing))]
+        with self.transaction() as conn:
+            conn.executemany('''INSERT INTO processed_urls (url_key, full_url, postcode, city, street, houseNumber, base_price, publication_date, closing_date, image_url) VALUES (:url_key, :full_url, :postcode, :city, :street, :houseNumber, :base_price, :publication_date, :closing_date, :image_url) ON CONFLICT DO NOTHING''',
+                             listings)
+            conn.executemany('''INSERT INTO outbox (url_key, user_id) SELECT ?, user_id FROM users WHERE is_active = TRUE AND user_id NOT IN (SELECT user_id FROM user_filters) ORDER BY user_id ON CONFLICT DO NOTHING''',
+                             [(listing['url_key'],) for listing in listings])
+            conn.executemany('''INSERT INTO outbox (url_key, user_id) SELECT ?, user_id FROM users WHERE user_id = ? AND is_active = TRUE ON CONFLICT DO NOTHING''',
+                             filtered_jobs)
+        self._get_known_url_keys().update(listing['url_key'] for listing in listings)
+        if self._visibility is not None:
+            placeholders = ','.join('?' * len(listings))
+            with self.get_db_connection() as conn:
+                rows = conn.execute(f"SELECT * FROM processed_urls WHERE url_key IN ({placeholders})",
+                                    [listing['url_key'] for listing in listings]).fetchall()
+            self._visibility.add([dict(row) for row in rows], datetime.now(timezone.utc))
+
+    def set_listing_image_file_id(self, url_key: str, file_id: str):
         with self.get_db_connection() as conn:
-            cursor = conn.execute('SELECT timezone FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            if result and result['timezone']:
-                try:
-                    return ZoneInfo(result['timezone'])
-                except ZoneInfoNotFoundError:
-                    return None
-            return None
+            conn.execute("UPDATE processed_urls SET image_file_id = ? WHERE url_key = ?", (file_id, url_key))
+            conn.commit()
 
-    def add_processed_url(self, **kwargs):
+    def mark_listing_image_failed(self, url_key: str):
         with self.get_db_connection() as conn:
-            conn.execute('''INSERT OR IGNORE INTO processed_urls (url_key, full_url, postcode, city, street, houseNumber, base_price, publication_date, closing_date, image_url) VALUES (:url_key, :full_url, :postcode, :city, :street, :houseNumber, :base_price, :publication_date, :closing_date, :image_url)''',
-                         kwargs)
+            conn.execute("UPDATE processed_urls SET image_failed = TRUE WHERE url_key = ?", (url_key,))
             conn.commit()
 
-    def add_sent_message(self, user_id: int, url_key: str):
+    def get_listing(self, url_key: str) -> Optional[Dict]:
         with self.get_db_connection() as conn:
-            conn.execute('INSERT INTO sent_messages (user_id, url_key) VALUES (?, ?)', (user_id, url_key))
-            conn.commit()
+            row = conn.execute("SELECT * FROM processed_urls WHERE url_key = ?", (url_key,)).fetchone()
+            return dict(row) if row else None
+
+    def claim_outbox_jobs(self, limit: int, exclude_ids: Iterable[int] = ()) -> List[Dict]:
+        """
+        Забирає до `limit` готових до відправки завдань (разом з профілем отримувача) і позначає їх 'sending'.
+        Завдання в 'sending', чия оренда (OUTBOX_LEASE_SECONDS) минула, теж забираються — так прохід,
+        перерваний помилкою, не лишає їх завислими до перезапуску; ті з них, що вже вичерпали
+        OUTBOX_MAX_ATTEMPTS спроб, позначаються 'failed', а не забираються по колу.
+        `exclude_ids` — завдання з результатом, ще не записаним у БД: вони не забираються.
+        Вибірка й оновлення — в одній транзакції; у PostgreSQL рядки ще й блокуються з SKIP LOCKED,
+        тож кілька воркерів не заберуть те саме завдання.
+        """
+        exclude_ids = set(exclude_ids)
+        lease_expired = format_timestamp(datetime.now(timezone.utc) - timedelta(seconds=OUTBOX_LEASE_SECONDS))
+        with self.transaction() as conn:
+            conn.execute("UPDATE outbox SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE status = 'sending' AND updated_at < ? AND attempts >= ?",
+                         (lease_expired, OUTBOX_MAX_ATTEMPTS))
+            rows = conn.execute(f'''
+                SELECT o.id, o.url_key, o.user_id, o.attempts, u.language, u.timezone, u.use_tracker, u.is_active
+                FROM outbox o JOIN users u ON u.user_id = o.user_id
+                WHERE (o.status = 'pending' AND o.next_attempt_at <= CURRENT_TIMESTAMP)
+                   OR (o.status = 'sending' AND o.updated_at < ? AND o.attempts < ?)
+                ORDER BY o.id LIMIT ?{self.storage.row_lock_clause('o')}
+            ''', (lease_expired, OUTBOX_MAX_ATTEMPTS, limit)).fetchall()
+            rows = [row for row in rows if row['id'] not in exclude_ids]
+            conn.executemany("UPDATE outbox SET status = 'sending', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             [(row['id'],) for row in rows])
+        return [dict(row, attempts=row['attempts'] + 1) for row in rows]
+
+    def record_outbox_results(self, sent: List[Tuple[int, int, str]], failed: List[Tuple[int, int]]):
+        """
+        Записує пачку результатів доставки однією транзакцією.
+        `sent` — (job_id, user_id, url_key): завдання 'sent' + рядок sent_messages.
+        `failed` — (job_id, attempts): повтор з експоненційною затримкою або 'failed' після OUTBOX_MAX_ATTEMPTS спроб.
+        """
+        if not sent and not failed:
+            return
+        now = datetime.now(timezone.utc)
+        retry_rows = [(format_timestamp(now + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))), job_id)
+                      for job_id, attempts in failed if attempts < OUTBOX_MAX_ATTEMPTS]
+        final_rows = [(job_id,) for job_id, attempts in failed if attempts >= OUTBOX_MAX_ATTEMPTS]
+        with self.transaction() as conn:
+            conn.executemany("UPDATE outbox SET status = 'sent', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             [(job_id,) for job_id, _, _ in sent])
+            conn.executemany('INSERT INTO sent_messages (user_id, url_key) VALUES (?, ?)',
+                             [(user_id, url_key) for _, user_id, url_key in sent])
+            conn.executemany("UPDATE outbox SET status = 'pending', next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             retry_rows)
+            conn.executemany("UPDATE outbox SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             final_rows)
+
+    def cancel_outbox_jobs(self, job_ids: List[int]):
+        if not job_ids:
+            return
+        with self.transaction() as conn:
+            conn.executemany("UPDATE outbox SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             [(job_id,) for job_id in job_ids])
+
+    def recover_outbox(self) -> int:
+        """
+        Викликається при старті: завдання, що лишились у 'sending' після падіння, повертаються в чергу,
+        а завершені завдання, старші за OUTBOX_RETENTION_DAYS, видаляються. Повертає кількість повернутих.
+        """
+        with self.transaction() as conn:
+            requeued = conn.execute("UPDATE outbox SET status = 'pending', updated_at = CURRENT_TIMESTAMP WHERE status = 'sending'").rowcount
+            conn.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed', 'cancelled') AND updated_at < ?",
+                         (format_timestamp(datetime.now(timezone.utc) - timedelta(days=OUTBOX_RETENTION_DAYS)),))
+        return requeued
 
     def add_donation(self, user_id: int, amount: int, currency: str, charge_id: str):
         with self.get_db_connection() as conn:
@@ -239,54 +471,213 @@ class DatabaseManager:
                          (user_id, amount, currency, charge_id))
             conn.commit()
 
-    def get_listings(self, view_type: str, sort_order: str = 'newest', limit: int = 5, offset: int = 0) -> List[Dict]:
-        base_query = "SELECT * FROM processed_urls"
-        if view_type == 'recent':
-            three_days_ago = (datetime.now(timezone.utc) - timedelta(days=3)).isoformat()
-            where_clause = "WHERE publication_date >= ?"
-            params = [three_days_ago]
-        elif view_type == 'active':
-            now_iso = datetime.now(timezone.utc).isoformat()
-            where_clause = "WHERE closing_date > ?"
-            params = [now_iso]
-        else:
-            return []
-        order_clause = "ORDER BY closing_date ASC" if sort_order == 'closing' else "ORDER BY publication_date DESC"
-        limit_clause = "LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
-        full_query = f"{base_query} {where_clause} {order_clause} {limit_clause}"
+    @property
+    def listing_filters(self) -> ListingFilterIndex:
+        """Індекс фільтрів підписки (завантажує таблицю user_filters при першому зверненні)."""
+        if self._listing_filters is None:
+            index = ListingFilterIndex()
+            with self.get_db_connection() as conn:
+                for row in conn.execute("SELECT * FROM user_filters"):
+                    index.set(row['user_id'], ListingFilter.from_row(row))
+            self._listing_filters = index
+        return self._listing_filters
+
+    def get_user_filter(self, user_id: int) -> ListingFilter:
+        return self.listing_filters.get(user_id) or ListingFilter()
+
+    def set_user_filter(self, user_id: int, listing_filter: ListingFilter):
+        """Зберігає фільтри користувача (порожні — видаляє рядок) і оновлює індекс."""
         with self.get_db_connection() as conn:
-            cursor = conn.execute(full_query, tuple(params))
-            return [dict(row) for row in cursor.fetchall()]
+            if listing_filter.is_empty():
+                conn.execute("DELETE FROM user_filters WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute('''INSERT INTO user_filters (user_id, cities, postcode_prefixes, min_price, max_price) VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT (user_id) DO UPDATE SET cities = excluded.cities, postcode_prefixes = excluded.postcode_prefixes, min_price = excluded.min_price, max_price = excluded.max_price, updated_at = CURRENT_TIMESTAMP''',
+                             (user_id, *listing_filter.to_row()))
+            conn.commit()
+        self.listing_filters.set(user_id, listing_filter)
+
+    @property
+    def visibility(self) -> ListingVisibilityIndex:
+        """Індекс видимості, доведений до поточного моменту (завантажує його з БД при першому зверненні)."""
+        now = datetime.now(timezone.utc)
+        if self._visibility is None:
+            index = ListingVisibilityIndex(RECENT_LISTINGS_DAYS, timedelta(days=HIGHLIGHT_DAYS_THRESHOLD),
+                                           parse_iso_datetime)
+            # Рядкове порівняння ISO-дат, як і раніше у переглядах; точні межі далі рахує сам індекс
+            with self.get_db_connection() as conn:
+                rows = conn.execute("SELECT * FROM processed_urls WHERE closing_date > ? OR publication_date >= ?",
+                                    ((now - timedelta(days=1)).isoformat(),
+                                     (now - timedelta(days=RECENT_LISTINGS_DAYS + 1)).isoformat())).fetchall()
+            index.add([dict(row) for row in rows], now)
+            self._visibility = index
+        self._visibility.advance(now)
+        return self._visibility
+
+    @property
+    def listings_version(self) -> int:
+        """Змінюється при вставці оголошень і при кожному переході видимості — за ним інвалідовуються кеші переглядів."""
+        return self.visibility.version
+
+    def get_listings(self, view_type: str, sort_order: str = 'newest', limit: int = 5, offset: int = 0,
+                     after_id: Optional[int] = None, before_id: Optional[int] = None) -> List[Dict]:
+        """
+        Сторінка оголошень з індексу видимості. З `after_id`/`before_id` — keyset-пагінація: наступна/попередня
+        сторінка відносно оголошення з цим id. Інакше — звичайний offset (старі callback-дані).
+        """
+        return self.visibility.page(view_type, sort_order, limit, offset, after_id=after_id, before_id=before_id)
 
     def get_listings_count(self, view_type: str) -> int:
-        base_query = "SELECT COUNT(id) FROM processed_urls"
-        if view_type == 'recent':
-            three_days_ago = (datetime.now(timezone.utc) - timedelta(days=3)).isoformat()
-            where_clause = "WHERE publication_date >= ?"
-            params = [three_days_ago]
-        elif view_type == 'active':
-            now_iso = datetime.now(timezone.utc).isoformat()
-            where_clause = "WHERE closing_date > ?"
-            params = [now_iso]
-        else:
-            return 0
-        full_query = f"{base_query} {where_clause}"
-        with self.get_db_connection() as conn:
-            cursor = conn.execute(full_query, tuple(params))
-            result = cursor.fetchone()
-            return result[0] if result else 0
+        return self.visibility.count(view_type)
+
+
+class ListingsPageCache:
+    """
+    LRU-кеш відрендерених сторінок переглядача: ключ — параметри сторінки та профілю, значення — (текст, клавіатура).
+    Повністю очищається, коли змінюється DatabaseManager.listings_version (нові оголошення або перехід видимості
+    в індексі) або спливає TTL (щоб не застарівав текст "закінчується через N год.").
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._version: Optional[int] = None
+        self._valid_until = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, version: int):
+        now = time.monotonic()
+        if version == self._version and now < self._valid_until:
+            return
+        self._entries.clear()
+        self._version = version
+        self._valid_until = now + self.ttl
+
+    def get(self, key: Tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Tuple, value: Tuple[str, Optional[InlineKeyboardMarkup]]):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class DeliveryRecorder:
+    """
+    Write-behind буфер результатів доставки: замість транзакції на кожне повідомлення
+    результати пишуться через record_outbox_results пачками. Один буфер живе весь час роботи бота: якщо запис
+    не вдався (наприклад, БД заблокована), результати лишаються в ньому, а їхні завдання не забираються знову,
+    доки запис не пройде. Завдання, не записані до падіння процесу, лишаються в 'sending' і повертаються
+    в чергу при старті (recover_outbox) — нічого не губиться, але до однієї незаписаної пачки може бути надіслано повторно.
+    """
+
+    def __init__(self, db: DatabaseManager, flush_size: int, flush_interval: float):
+        self.db = db
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self._sent: List[Tuple[int, int, str]] = []
+        self._failed: List[Tuple[int, int]] = []
+        self._last_flush = time.monotonic()
+        self.records = 0
+        self.flushes = 0
+
+    def sent(self, job_id: int, user_id: int, url_key: str):
+        self._sent.append((job_id, user_id, url_key))
+        self._maybe_flush()
+
+    def failed(self, job_id: int, attempts: int):
+        self._failed.append((job_id, attempts))
+        self._maybe_flush()
+
+    def pending_job_ids(self) -> set:
+        """Завдання, результат яких уже відомий, але ще не записаний у БД."""
+        return {job_id for job_id, _, _ in self._sent} | {job_id for job_id, _ in self._failed}
+
+    def _maybe_flush(self):
+        if (len(self._sent) + len(self._failed) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self) -> bool:
+        """Записує буфер однією транзакцією. Повертає False, якщо запис не вдався (буфер зберігається)."""
+        self._last_flush = time.monotonic()
+        if not self._sent and not self._failed:
+            return True
+        try:
+            self.db.record_outbox_results(self._sent, self._failed)
+        except Exception as e:
+            logger.error(f"Failed to record {len(self._sent) + len(self._failed)} delivery results, "
+                         f"keeping them for the next flush: {e}")
+            return False
+        self.records += len(self._sent) + len(self._failed)
+        self.flushes += 1
+        self._sent, self._failed = [], []
+        return True
+
+    async def flush_with_retry(self, attempts: int = OUTBOX_FLUSH_RETRIES) -> bool:
+        for attempt in range(attempts):
+            if self.flush():
+                return True
+            if attempt + 1 < attempts:
+                await asyncio.sleep(2 ** attempt)
+        return False
 
 
 class WHBot:
-    def __init__(self, token: str, db_path: str):
+    def __init__(self, token: str, database_url: str):
         self.token = token
-        self.db = DatabaseManager(db_path)
-        self.app = Application.builder().token(token).build()
+        self.db = DatabaseManager(database_url)
+        self.app = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self.job_queue = self.app.job_queue
         self.is_tracker_healthy = True
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.webhook_url = ""
+        self.webhook_secret_token = ""
+        # page -> (валідатори ETag/Last-Modified, останнє тіло відповіді) для умовних запитів
+        self._api_cache: Dict[int, Tuple[Dict[str, str], Dict]] = {}
+        self.page_cache = ListingsPageCache(LISTINGS_PAGE_CACHE_SIZE, LISTINGS_PAGE_CACHE_TTL)
+        self._outbox_lock = asyncio.Lock()
+        self.delivery_recorder = DeliveryRecorder(self.db, OUTBOX_FLUSH_SIZE, OUTBOX_FLUSH_INTERVAL)
+        self._visibility_job = None
+        self.db.visibility.on_expiring_soon(self._on_listing_expiring_soon)
+        # Недосяжні чати, знайдені в поточному проході outbox, і скільки всього отримувачів прибрано з розсилки
+        self._unreachable_users: set = set()
+        self.reclaimed_slots = 0
+        self.broadcaster = Broadcaster(BROADCAST_CONCURRENCY, BROADCAST_GLOBAL_RATE, BROADCAST_PER_CHAT_RATE,
+                                       max_retries=BROADCAST_MAX_RETRIES)
         self.setup_handlers()
 
+    def get_http_client(self) -> httpx.AsyncClient:
+        if self.http_client is None or self.http_client.is_closed:
+            self.http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(API_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                headers={'Accept': 'application/json'},
+            )
+        return self.http_client
+
+    async def _post_shutdown(self, application: Application):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+        self.db.close()
+        logger.info(f"Database pool closed ({self.db.connections_opened} connections opened in total).")
+
     async def check_tracker_health(self, context: ContextTypes.DEFAULT_TYPE):
         if not TRACKER_BASE_URL:
             if self.is_tracker_healthy:
@@ -295,40 +686,51 @@ class WHBot:
             return
 
         try:
-            # Використовуємо простий HEAD запит, щоб не завантажувати сторінку
             health_check_url = f"{TRACKER_BASE_URL.rstrip('/')}/health"
-            response = requests.get(health_check_url, timeout=5)
+            response = await self.get_http_client().get(health_check_url, timeout=5)
             response.raise_for_status()
             if not self.is_tracker_healthy:
                 logger.info("Сервіс трекінгу відновив роботу.")
             self.is_tracker_healthy = True
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             if self.is_tracker_healthy:
                 logger.warning(f"Сервіс трекінгу недоступний: {e}. Перемикаюсь на прямі посилання.")
             self.is_tracker_healthy = False
 
 
-    def _get_final_url(self, user_id: int, listing_data: Dict) -> str:
+    @staticmethod
+    def _tracker_link_prefix(user_id) -> str:
+        return f"{TRACKER_BASE_URL}/track?user_id={user_id}&"
+
+    def _get_final_url(self, user_id: int, listing_data: Dict, use_tracker: Optional[bool] = None) -> str:
         """Повертає URL для трекінгу або прямий URL залежно від налаштувань та стану трекера."""
-        user_wants_tracking = self.db.get_user_tracker_preference(user_id)
-        
+        user_wants_tracking = self.db.get_user_tracker_preference(user_id) if use_tracker is None else use_tracker
+
         if self.is_tracker_healthy and user_wants_tracking:
-            return f"{TRACKER_BASE_URL}/track?user_id={user_id}&url_key={listing_data['url_key']}"
+            return f"{self._tracker_link_prefix(user_id)}url_key={listing_data['url_key']}"
         else:
             return listing_data['full_url']
         
+    @staticmethod
+    def translate(lang: str, key: str, **kwargs) -> str:
+        # У CATALOG резервні переклади вже підставлені — один пошук замість двох
+        text = (CATALOG.get(lang) or CATALOG[DEFAULT_LANGUAGE]).get(key, f"_{key}_")
+        return text.format(**kwargs)
+
     def get_text(self, user_id: int, key: str, **kwargs) -> str:
+        return self.translate(self.db.get_user_language(user_id), key, **kwargs)
+
+    def get_translator(self, user_id: int) -> Callable[..., str]:
+        """Функція перекладу, прив'язана до мови користувача: профіль читається один раз на запит."""
         lang = self.db.get_user_language(user_id)
-        text = TRANSLATIONS.get(lang, {}).get(key)
-        if not text:
-            text = TRANSLATIONS['en'].get(key, f"_{key}_")
-        return text.format(**kwargs)
+        return lambda key, **kwargs: self.translate(lang, key, **kwargs)
 
     def get_main_keyboard(self, user_id: int) -> ReplyKeyboardMarkup:
+        t = self.get_translator(user_id)
         keyboard = [
-            [self.get_text(user_id, 'main_menu_view_listings')],
-            [self.get_text(user_id, 'main_menu_donate'), self.get_text(user_id, 'main_menu_settings')],
-            [self.get_text(user_id, 'main_menu_help')]
+            [t('main_menu_view_listings')],
+            [t('main_menu_donate'), t('main_menu_settings')],
+            [t('main_menu_help')]
         ]
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
 
@@ -339,24 +741,32 @@ class WHBot:
         self.app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, self.successful_payment_callback))
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_buttons))
 
+        # Підпис кнопки меню (будь-якою мовою — клавіатура могла лишитись від попередньої мови) -> обробник
+        actions = {
+            'main_menu_view_listings': self.show_listings_command,
+            'main_menu_donate': self.donate_command,
+            'main_menu_settings': self.settings_command,
+            'main_menu_help': self.help_command,
+        }
+        self._text_button_handlers = {label: actions[key] for label, key in MENU_BUTTON_ACTIONS.items()}
+
     async def handle_text_buttons(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        text = update.message.text
-
-        if text == self.get_text(user_id, 'main_menu_view_listings'):
-            await self.show_listings_command(update, context)
-        elif text == self.get_text(user_id, 'main_menu_donate'):
-            await self.donate_command(update, context)
-        elif text == self.get_text(user_id, 'main_menu_settings'):
-            await self.settings_command(update, context)
-        elif text == self.get_text(user_id, 'main_menu_help'):
-            await self.help_command(update, context)
+        handler = self._text_button_handlers.get(update.message.text)
+        if handler is not None:
+            context.user_data.pop('pending_filter', None)
+            await handler(update, context)
+        elif context.user_data.get('pending_filter'):
+            await self._handle_filter_input(update, context)
         else:
-            await update.message.reply_text(self.get_text(user_id, 'unknown_command'), parse_mode='MarkdownV2')
+            await update.message.reply_text(self.get_text(update.effective_user.id, 'unknown_command'),
+                                            parse_mode='MarkdownV2')
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         db_user = self.db.add_or_get_user(user.id, user.username, user.first_name, user.language_code)
+        if db_user.get('blocked_at'):
+            # Користувач, якого бот відписав через блокування, знову пише боту — повертаємо підписку
+            self.db.set_user_active(user.id, True)
 
         is_first_time = db_user['created_at'] == db_user['updated_at']
         text_key = 'welcome_first_time' if is_first_time else 'welcome_back'
@@ -396,21 +806,22 @@ class WHBot:
 
     async def _send_settings_menu(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE, query: Optional[CallbackQuery] = None):
         user_id = chat_id
-        is_subscribed = self.db.get_user_status(user_id)
-        use_tracker = self.db.get_user_tracker_preference(user_id)
-        
-        sub_button_text = self.get_text(user_id, 'settings_unsubscribe' if is_subscribed else 'settings_subscribe')
-        tracker_button_text = self.get_text(user_id, 'settings_disable_tracker' if use_tracker else 'settings_enable_tracker')
+        profile = self.db.get_user_profile(user_id)
+        t = self.get_translator(user_id)
+
+        sub_button_text = t('settings_unsubscribe' if profile['is_active'] else 'settings_subscribe')
+        tracker_button_text = t('settings_disable_tracker' if profile['use_tracker'] else 'settings_enable_tracker')
         timezone_url = f"{TRACKER_BASE_URL}/get_tz?user_id={user_id}"
 
         keyboard = [
             [InlineKeyboardButton(sub_button_text, callback_data="toggle_subscription")],
             [InlineKeyboardButton(tracker_button_text, callback_data="toggle_tracker")],
-            [InlineKeyboardButton(self.get_text(user_id, 'settings_set_timezone'), url=timezone_url)],
-            [InlineKeyboardButton(self.get_text(user_id, 'settings_change_language'), callback_data="show_lang_menu")]
+            [InlineKeyboardButton(t('settings_filters'), callback_data="show_filters_menu")],
+            [InlineKeyboardButton(t('settings_set_timezone'), url=timezone_url)],
+            [InlineKeyboardButton(t('settings_change_language'), callback_data="show_lang_menu")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        text = self.get_text(user_id, 'settings_menu_title')
+        text = t('settings_menu_title')
 
         if query:
             try:
@@ -420,6 +831,67 @@ class WHBot:
         else:
             await context.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode='MarkdownV2')
 
+    async def _send_filters_menu(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE, query: Optional[CallbackQuery] = None):
+        user_id = chat_id
+        listing_filter = self.db.get_user_filter(user_id)
+        t = self.get_translator(user_id)
+
+        any_text = t('filter_any')
+        if listing_filter.min_price is not None and listing_filter.max_price is not None:
+            price_text = t('filter_price_between', min_price=listing_filter.min_price, max_price=listing_filter.max_price)
+        elif listing_filter.min_price is not None:
+            price_text = t('filter_price_from', min_price=listing_filter.min_price)
+        elif listing_filter.max_price is not None:
+            price_text = t('filter_price_up_to', max_price=listing_filter.max_price)
+        else:
+            price_text = any_text
+        text = t('filters_menu_title',
+                 cities=escape_markdown_v2(', '.join(listing_filter.cities) or any_text),
+                 postcodes=escape_markdown_v2(', '.join(listing_filter.postcode_prefixes) or any_text),
+                 price=escape_markdown_v2(price_text))
+
+        keyboard = [
+            [InlineKeyboardButton(t('filter_set_city'), callback_data="set_filter:city")],
+            [InlineKeyboardButton(t('filter_set_postcode'), callback_data="set_filter:postcode")],
+            [InlineKeyboardButton(t('filter_set_price'), callback_data="set_filter:price")],
+        ]
+        if not listing_filter.is_empty():
+            keyboard.append([InlineKeyboardButton(t('filter_reset'), callback_data="reset_filters")])
+        keyboard.append([InlineKeyboardButton(t('back_to_settings'), callback_data="show_settings_menu")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        if query:
+            try:
+                await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
+            except telegram.error.BadRequest as e:
+                if "Message is not modified" not in str(e): logger.error(f"Error editing filters menu: {e}")
+        else:
+            await context.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode='MarkdownV2')
+
+    @staticmethod
+    def _parse_filter_input(field: str, text: str) -> Dict:
+        """Зміни ListingFilter для введеного тексту; '-' прибирає фільтр. ValueError — якщо текст не розпізнано."""
+        clear = text.strip() in ('-', '–')
+        if field == 'city':
+            return {'cities': () if clear else parse_cities(text)}
+        if field == 'postcode':
+            return {'postcode_prefixes': () if clear else parse_postcode_prefixes(text)}
+        if field == 'price':
+            min_price, max_price = (None, None) if clear else parse_price_range(text)
+            return {'min_price': min_price, 'max_price': max_price}
+        raise ValueError(field)
+
+    async def _handle_filter_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        try:
+            changes = self._parse_filter_input(context.user_data['pending_filter'], update.message.text)
+        except ValueError:
+            await update.message.reply_text(self.get_text(user_id, 'filter_invalid'), parse_mode='MarkdownV2')
+            return
+        context.user_data.pop('pending_filter', None)
+        self.db.set_user_filter(user_id, self.db.get_user_filter(user_id).replace(**changes))
+        await self._send_filters_menu(update.message.chat_id, context)
+
     async def _send_lang_menu(self, query: CallbackQuery):
         user_id = query.from_user.id
         keyboard = [
@@ -449,8 +921,28 @@ class WHBot:
             return
 
         if data == "show_settings_menu":
+            context.user_data.pop('pending_filter', None)
             await self._send_settings_menu(user_id, context, query=query)
             return
+        if data == "show_filters_menu":
+            context.user_data.pop('pending_filter', None)
+            await self._send_filters_menu(user_id, context, query=query)
+            return
+        if data.startswith("set_filter:"):
+            field = data.split(':')[1]
+            if field in ('city', 'postcode', 'price'):
+                # Наступне текстове повідомлення користувача — значення цього фільтра
+                context.user_data['pending_filter'] = field
+                keyboard = [[InlineKeyboardButton(self.get_text(user_id, 'back_to_filters'),
+                                                  callback_data="show_filters_menu")]]
+                await query.edit_message_text(self.get_text(user_id, f'filter_prompt_{field}'),
+                                              reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='MarkdownV2')
+            return
+        if data == "reset_filters":
+            self.db.set_user_filter(user_id, ListingFilter())
+            await query.answer(self.get_text(user_id, 'filters_reset_alert'), show_alert=True)
+            await self._send_filters_menu(user_id, context, query=query)
+            return
         if data == "toggle_tracker":
             current_pref = self.db.get_user_tracker_preference(user_id)
             self.db.set_user_tracker_preference(user_id, not current_pref)
@@ -490,34 +982,60 @@ class WHBot:
             return
 
         try:
-            view_type, sort_order, page_str = data.split(':')
+            # Формат: view:sort:page[:cursor], де cursor — 'a<id>' (після) або 'b<id>' (перед) оголошенням
+            view_type, sort_order, page_str, *cursor = data.split(':')
+            if len(cursor) > 1:
+                raise ValueError(data)
             page = int(page_str)
-            await self._edit_paginated_listings(query, view_type, sort_order, page)
+            await self._edit_paginated_listings(query, view_type, sort_order, page, cursor[0] if cursor else None)
         except (ValueError, IndexError):
             logger.warning(f"Invalid pagination callback data: {data}")
 
-    async def _send_paginated_listings(self, message: Message, view_type: str, sort_order: str, page: int):
-        user_id = message.from_user.id
-        offset = page * LISTINGS_PER_PAGE
-        listings = self.db.get_listings(view_type, sort_order, LISTINGS_PER_PAGE, offset)
+    def _fetch_listings_page(self, view_type: str, sort_order: str, page: int, cursor: Optional[str]) -> List[Dict]:
+        after_id = before_id = None
+        if cursor:
+            anchor_id = int(cursor[1:])
+            if cursor[0] == 'a':
+                after_id = anchor_id
+            elif cursor[0] == 'b':
+                before_id = anchor_id
+            else:
+                raise ValueError(cursor)
+        return self.db.get_listings(view_type, sort_order, LISTINGS_PER_PAGE, page * LISTINGS_PER_PAGE,
+                                    after_id=after_id, before_id=before_id)
+
+    def _render_listings_page(self, user_id: int, view_type: str, sort_order: str, page: int,
+                              cursor: Optional[str]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """Сторінка переглядача з кешу; SQLite та форматування — лише при промаху."""
+        profile = self.db.get_user_profile(user_id)
+        tracking = self.is_tracker_healthy and profile['use_tracker']
+        key = (view_type, sort_order, page, cursor, profile['language'], profile['timezone'], tracking)
+        self.page_cache.validate(self.db.listings_version)
+
+        # Єдина персональна частина сторінки — user_id у трекінг-посиланнях, тому в кеші він замінений маркером
+        link_prefix = self._tracker_link_prefix(user_id)
+        cached = self.page_cache.get(key)
+        if cached is not None:
+            text, reply_markup = cached
+            return (text.replace(self._tracker_link_prefix('{user_id}'), link_prefix) if tracking else text), reply_markup
+
+        listings = self._fetch_listings_page(view_type, sort_order, page, cursor)
         total_listings = self.db.get_listings_count(view_type)
-
-        if not listings:
-            no_listings_key = 'no_recent_listings' if view_type == 'recent' else 'no_active_listings'
-            await message.reply_text(self.get_text(user_id, no_listings_key))
-            return
-
         text, reply_markup = self._generate_listings_view(user_id, listings, total_listings, page, sort_order,
                                                           view_type)
+        template = text.replace(link_prefix, self._tracker_link_prefix('{user_id}')) if tracking else text
+        self.page_cache.put(key, (template, reply_markup))
+        return text, reply_markup
+
+    async def _send_paginated_listings(self, message: Message, view_type: str, sort_order: str, page: int):
+        user_id = message.from_user.id
+        text, reply_markup = self._render_listings_page(user_id, view_type, sort_order, page, None)
         await message.reply_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
 
-    async def _edit_paginated_listings(self, query: CallbackQuery, view_type: str, sort_order: str, page: int):
+    async def _edit_paginated_listings(self, query: CallbackQuery, view_type: str, sort_order: str, page: int,
+                                       cursor: Optional[str] = None):
         user_id = query.from_user.id
-        offset = page * LISTINGS_PER_PAGE
-        listings = self.db.get_listings(view_type, sort_order, LISTINGS_PER_PAGE, offset)
-        total_listings = self.db.get_listings_count(view_type)
-        text, reply_markup = self._generate_listings_view(user_id, listings, total_listings, page, sort_order,
-                                                          view_type)
+        text, reply_markup = self._render_listings_page(user_id, view_type, sort_order, page, cursor)
 
         try:
             await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
@@ -527,14 +1045,18 @@ class WHBot:
 
     def _generate_listings_view(self, user_id: int, listings: List[Dict], total_listings: int, page: int,
                                 sort_order: str, view_type: str) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        t = self.get_translator(user_id)
         if not listings:
             key = 'no_recent_listings' if view_type == 'recent' else 'no_active_listings'
-            return self.get_text(user_id, key), None
+            return t(key), None
 
         message_parts = []
+        visibility = self.db.visibility
         for listing in listings:
             title, body = self._prepare_listing_text(user_id, listing)
-            time_left_text = self._format_time_left(user_id, listing.get('closing_date'))
+            # Підсвітка "закінчується через ..." лише для оголошень, які індекс уже позначив як такі
+            time_left_text = self._format_time_left(user_id, listing.get('closing_date')) \
+                if visibility.is_expiring_soon(listing['id']) else None
             full_listing_text = f"**{title}**\n{body}"
             if time_left_text:
                 full_listing_text += f"\n{time_left_text}"
@@ -544,7 +1066,7 @@ class WHBot:
         total_pages = (total_listings + LISTINGS_PER_PAGE - 1) // LISTINGS_PER_PAGE or 1
         keyboard = []
 
-        newest_text, closing_text, placeholder = self.get_text(user_id, 'sort_by_newest'), self.get_text(user_id, 'sort_by_closing_date'), self.get_text(user_id, 'data_placeholder')
+        newest_text, closing_text, placeholder = t('sort_by_newest'), t('sort_by_closing_date'), t('data_placeholder')
         sort_buttons = [
             InlineKeyboardButton(f"✅ {newest_text}",
                                  callback_data=placeholder) if sort_order == 'newest' else InlineKeyboardButton(
@@ -556,47 +1078,58 @@ class WHBot:
         keyboard.append(sort_buttons)
 
         if total_pages > 1:
+            # Перша сторінка завжди без курсора; інші — keyset відносно крайніх оголошень поточної сторінки
+            prev_callback = f"{view_type}:{sort_order}:0" if page <= 1 else \
+                f"{view_type}:{sort_order}:{page - 1}:b{listings[0]['id']}"
+            next_callback = f"{view_type}:{sort_order}:{page + 1}:a{listings[-1]['id']}"
             nav_buttons = [
                 InlineKeyboardButton("⬅️",
-                                     callback_data=f"{view_type}:{sort_order}:{page - 1}") if page > 0 else InlineKeyboardButton(
+                                     callback_data=prev_callback) if page > 0 else InlineKeyboardButton(
                     " ", callback_data=placeholder),
-                InlineKeyboardButton(self.get_text(user_id, 'page_info', page=page + 1, total_pages=total_pages),
+                InlineKeyboardButton(t('page_info', page=page + 1, total_pages=total_pages),
                                      callback_data=placeholder),
                 InlineKeyboardButton("➡️",
-                                     callback_data=f"{view_type}:{sort_order}:{page + 1}") if page < total_pages - 1 else InlineKeyboardButton(
+                                     callback_data=next_callback) if page < total_pages - 1 else InlineKeyboardButton(
                     " ", callback_data=placeholder)
             ]
             keyboard.append(nav_buttons)
 
         switch_text, switch_callback = (
-            self.get_text(user_id, 'go_to_active'), f"active:{sort_order}:0") if view_type == 'recent' else (
-            self.get_text(user_id, 'go_to_recent'), f"recent:{sort_order}:0")
+            t('go_to_active'), f"active:{sort_order}:0") if view_type == 'recent' else (
+            t('go_to_recent'), f"recent:{sort_order}:0")
         keyboard.append([InlineKeyboardButton(switch_text, callback_data=switch_callback)])
 
         return full_text, InlineKeyboardMarkup(keyboard)
 
+    def _render_listing_text(self, lang: str, user_tz: Optional[ZoneInfo], listing_data: Dict) -> Tuple[str, str]:
+        """Заголовок і тіло оголошення для мови та часового поясу — без персонального посилання."""
+        # Статичні частини шаблонів екрановані при імпорті (formatting.py), тут екрануються лише поля
+        templates = LISTING_TEMPLATES.get(lang) or LISTING_TEMPLATES['en']
+        not_specified_text = templates.not_specified
+        title = templates.title.render(**{k: listing_data.get(k) or not_specified_text for k in
+                                          ('postcode', 'city', 'street', 'houseNumber')})
+        body = templates.body.render(
+            base_price=listing_data.get('base_price') or not_specified_text,
+            publication_date=self.format_date(lang, user_tz, listing_data.get('publication_date')),
+            closing_date=self.format_date(lang, user_tz, listing_data.get('closing_date')),
+        )
+        return title, body
+
+    def _render_listing_message(self, lang: str, user_tz: Optional[ZoneInfo], listing_data: Dict) -> Tuple[str, str]:
+        """Текст сповіщення та підпис кнопки — однакові для всіх отримувачів з тією ж мовою та часовим поясом."""
+        title, body = self._render_listing_text(lang, user_tz, listing_data)
+        return f"**{title}**\n\n{body}", (LISTING_TEMPLATES.get(lang) or LISTING_TEMPLATES['en']).view_button
+
     def _prepare_listing_text(self, user_id: int, listing_data: Dict, include_link_in_body: bool = True) -> Tuple[
         str, str]:
-        not_specified_text = self.get_text(user_id, 'not_specified')
-        safe_address = {k: escape_markdown_v2(listing_data.get(k) or not_specified_text) for k in
-                        ['postcode', 'city', 'street', 'houseNumber']}
-        title = self.get_text(user_id, 'new_listing_title', **safe_address)
-
-        pub_date = self.format_date_for_user(user_id, listing_data.get('publication_date'))
-        close_date = self.format_date_for_user(user_id, listing_data.get('closing_date'))
-
-        body_data = {
-            'base_price': escape_markdown_v2(listing_data.get('base_price') or not_specified_text),
-            'publication_date': escape_markdown_v2(pub_date),
-            'closing_date': escape_markdown_v2(close_date)
-        }
-        body = self.get_text(user_id, 'new_listing_body', **body_data)
+        profile = self.db.get_user_profile(user_id)
+        title, body = self._render_listing_text(profile['language'], profile['timezone'], listing_data)
 
         if include_link_in_body:
             # Використовуємо новий метод для отримання URL
             final_url = self._get_final_url(user_id, listing_data)
-            view_button_text = self.get_text(user_id, 'view_listing_button')
-            body += f"\n[{escape_markdown_v2(view_button_text)}]({final_url})"
+            templates = LISTING_TEMPLATES.get(profile['language']) or LISTING_TEMPLATES['en']
+            body += f"\n[{templates.view_button_escaped}]({final_url})"
 
         return title, body
 
@@ -604,7 +1137,7 @@ class WHBot:
         if not closing_date_str: return None
         try:
             now = datetime.now(timezone.utc)
-            closing_dt = datetime.fromisoformat(closing_date_str.replace('Z', '+00:00'))
+            closing_dt = parse_iso_datetime(closing_date_str)
             if closing_dt <= now: return None
 
             time_left = closing_dt - now
@@ -621,14 +1154,12 @@ class WHBot:
         except (ValueError, TypeError):
             return None
 
-    def format_date_for_user(self, user_id: int, date_str: str) -> str:
+    def format_date(self, lang: str, user_tz: Optional[ZoneInfo], date_str: str) -> str:
         if not date_str:
-            return self.get_text(user_id, 'not_specified')
+            return self.translate(lang, 'not_specified')
         try:
-            user_tz = self.db.get_user_timezone(user_id) or NETHERLANDS_TZ
-            dt_utc = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-            return dt_utc.astimezone(user_tz).strftime('%d.%m.%Y %H:%M')
-        except (ValueError, TypeError):
+            return format_local_datetime(date_str, user_tz or NETHERLANDS_TZ)
+        except (ValueError, TypeError, AttributeError):
             return date_str
 
     async def send_invoice(self, user_id: int, amount: int):
@@ -657,106 +1188,360 @@ class WHBot:
         )
         await update.message.reply_text(self.get_text(user_id, 'payment_successful'))
 
-    async def send_listing_message(self, user_id: int, listing_data: Dict):
+    async def send_listing_message(self, user_id: int, listing_data: Dict, profile: Optional[Dict] = None,
+                                   rendered: Optional[Dict] = None):
+        """
+        Надсилає оголошення користувачу. `rendered` — спільний для розсилки кеш
+        (мова, часовий пояс) -> (текст, підпис кнопки): текст рендериться один раз на групу,
+        а персональним лишається тільки URL кнопки.
+        """
         url_key = listing_data['url_key']
-        title, body = self._prepare_listing_text(user_id, listing_data, include_link_in_body=False)
-        message_text = f"**{title}**\n\n{body}"
-
-        final_url = self._get_final_url(user_id, listing_data)
-        keyboard = [[InlineKeyboardButton(self.get_text(user_id, 'view_listing_button'), url=final_url)]]
-        image_url = listing_data.get('image_url')
+        profile = profile or self.db.get_user_profile(user_id)
+        rendered = {} if rendered is None else rendered
+        group_key = (profile['language'], profile['timezone'])
+        if group_key not in rendered:
+            rendered[group_key] = self._render_listing_message(profile['language'], profile['timezone'], listing_data)
+        message_text, button_text = rendered[group_key]
+
+        final_url = self._get_final_url(user_id, listing_data, profile['use_tracker'])
+        keyboard = [[InlineKeyboardButton(button_text, url=final_url)]]
+        # Після першого успішного надсилання Telegram вже має фото — далі передаємо лише його file_id
+        image_url = None if listing_data.get('image_failed') else (
+            listing_data.get('image_file_id') or listing_data.get('image_url'))
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         try:
             if image_url:
-                await self.app.bot.send_photo(chat_id=user_id, photo=image_url, caption=message_text,
-                                              reply_markup=reply_markup, parse_mode='MarkdownV2')
+                message = await self.app.bot.send_photo(chat_id=user_id, photo=image_url, caption=message_text,
+                                                        reply_markup=reply_markup, parse_mode='MarkdownV2')
+                if not listing_data.get('image_file_id') and message.photo:
+                    listing_data['image_file_id'] = message.photo[-1].file_id
+                    self.db.set_listing_image_file_id(url_key, listing_data['image_file_id'])
             else:
                 await self.app.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup,
                                                 parse_mode='MarkdownV2')
             return True
+        except telegram.error.RetryAfter:
+            # Flood control обробляє Broadcaster: він зачекає та повторить відправку
+            raise
         except Exception as e:
+            if is_permanent_delivery_error(e):
+                # Чат недосяжний — повтор текстом нічого не дасть, рішення приймає Broadcaster
+                raise
             logger.error(f"Error sending notification to {user_id} for {url_key}: {e}")
             if image_url:
+                if isinstance(e, telegram.error.BadRequest) and any(m in str(e).lower() for m in PHOTO_ERROR_MARKERS):
+                    # Зображення недоступне — запам'ятовуємо, щоб решта отримувачів одразу отримали текст
+                    listing_data['image_failed'] = True
+                    self.db.mark_listing_image_failed(url_key)
                 try:
                     logger.warning(f"Retrying notification for {url_key} as text after photo failure.")
                     await self.app.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup,
                                                     parse_mode='MarkdownV2')
                     return True
+                except telegram.error.RetryAfter:
+                    raise
                 except Exception as inner_e:
+                    if is_permanent_delivery_error(inner_e):
+                        raise
                     logger.error(f"Failed to send notification as text as well: {inner_e}")
             return False
 
-    def fetch_json_data(self, page: int = 0) -> Optional[Dict]:
-        try:
-            response = requests.get(API_URL, params={'limit': 100, 'page': page}, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            logger.error(f"API request failed: {e}")
-            return None
+    async def _broadcast_listing(self, listing_data: Dict, jobs: List[Dict]):
+        """Доставляє одне оголошення за завданнями outbox; кожне завдання завершується або планується на повтор."""
+        url_key = listing_data['url_key']
+        photo_lock = asyncio.Lock()
+        jobs_by_user = {job['user_id']: job for job in jobs}
+        # Профілі беремо з уже прочитаних рядків outbox+users — жодних запитів до БД на отримувача
+        profiles = {user_id: self.db.profile_from_row(job) for user_id, job in jobs_by_user.items()}
+        rendered: Dict[Tuple[str, Optional[ZoneInfo]], Tuple[str, str]] = {}
+        resolved = set()
+        recorder = self.delivery_recorder
+        records_before, flushes_before = recorder.records, recorder.flushes
+
+        async def deliver(user_id: int) -> bool:
+            job = jobs_by_user[user_id]
+            try:
+                delivered = await self.send_listing_message(user_id, listing_data, profiles[user_id], rendered)
+            except Exception as e:
+                # Завдання недосяжних чатів скасовує deactivate_unreachable_users після розсилки
+                if is_permanent_delivery_error(e):
+                    resolved.add(user_id)
+                raise
+            if delivered:
+                recorder.sent(job['id'], user_id, url_key)
+            else:
+                recorder.failed(job['id'], job['attempts'])
+            resolved.add(user_id)
+            return delivered
+
+        async def send(user_id: int) -> bool:
+            if listing_data.get('image_url') and not listing_data.get('image_file_id') \
+                    and not listing_data.get('image_failed'):
+                # Поки file_id невідомий, фото надсилається по одному: перший успіх дає file_id для всіх інших
+                async with photo_lock:
+                    return await deliver(user_id)
+            return await deliver(user_id)
 
-    async def process_new_listings(self, context: ContextTypes.DEFAULT_TYPE):
-        logger.info("Starting new listings processing cycle.")
-        active_users = self.db.get_active_users()
-        if not active_users:
-            logger.info("No active users, skipping processing cycle.")
+        try:
+            stats = await self.broadcaster.broadcast(profiles, send, label=url_key)
+        finally:
+            # Записуємо накопичене і тоді, коли розсилку перервано (зупинка бота скасовує задачу);
+            # flush не кидає винятків, тож не підміняє собою початкову помилку
+            recorder.flush()
+        if stats.unreachable:
+            self.db.deactivate_unreachable_users(stats.unreachable)
+            self._unreachable_users.update(stats.unreachable)
+            self.reclaimed_slots += len(stats.unreachable)
+            logger.warning(f"Deactivated {len(stats.unreachable)} unreachable chats after {url_key}; "
+                           f"{self.reclaimed_slots} broadcast slots reclaimed since start.")
+        # Завдання, де відправка так і не відбулась (flood control вичерпав спроби, неочікувана помилка)
+        for user_id in profiles.keys() - resolved:
+            recorder.failed(jobs_by_user[user_id]['id'], jobs_by_user[user_id]['attempts'])
+        if not await recorder.flush_with_retry():
+            # Результати лишаються в буфері: drain_outbox запише їх перед наступним забором і не забере ці завдання
+            logger.error(f"Could not record delivery results for {url_key}; keeping them until the database recovers.")
+        logger.info(f"Delivery results for {url_key}: {recorder.records - records_before} records "
+                    f"in {recorder.flushes - flushes_before} transactions.")
+        return stats
+
+    async def _deliver_listing_jobs(self, url_key: str, jobs: List[Dict]):
+        listing_data = self.db.get_listing(url_key)
+        stale = listing_data is None
+        if listing_data and listing_data.get('closing_date'):
+            try:
+                # Після довгого простою не розсилаємо оголошення, на які вже не можна відгукнутись
+                closing = parse_iso_datetime(listing_data['closing_date'])
+                # Дата без зсуву вважається UTC — так само, як в індексі видимості
+                if closing.tzinfo is None:
+                    closing = closing.replace(tzinfo=timezone.utc)
+                stale = closing <= datetime.now(timezone.utc)
+            except (ValueError, TypeError):
+                pass
+        if stale:
+            self.db.cancel_outbox_jobs([job['id'] for job in jobs])
+            logger.info(f"Cancelled {len(jobs)} notifications for closed or missing listing {url_key}.")
             return
 
-        page = 0
-        while True:
-            data = self.fetch_json_data(page)
-            if not data or not data.get('data'):
+        # Користувачі, що відписались після постановки в чергу (або виявились недосяжними в цьому ж
+        # проході — їхні завдання вже скасовані), сповіщення не отримують
+        self.db.cancel_outbox_jobs([job['id'] for job in jobs
+                                    if not job['is_active'] and job['user_id'] not in self._unreachable_users])
+        active_jobs = [job for job in jobs if job['is_active'] and job['user_id'] not in self._unreachable_users]
+        if active_jobs:
+            stats = await self._broadcast_listing(listing_data, active_jobs)
+            logger.info(f"Broadcast {stats.summary()}")
+
+    async def drain_outbox(self, context: Optional[ContextTypes.DEFAULT_TYPE] = None):
+        """Доставляє всі готові завдання outbox пачками по OUTBOX_BATCH_SIZE. Одночасно працює лише один прохід."""
+        if self._outbox_lock.locked():
+            return
+        async with self._outbox_lock:
+            self._unreachable_users.clear()
+            while True:
+                # Спершу дописуємо результати, що не записались раніше; поки запис не пройде, їхні завдання
+                # не забираються (інакше після оренди вже доставлене повідомлення пішло б удруге)
+                self.delivery_recorder.flush()
+                jobs = self.db.claim_outbox_jobs(OUTBOX_BATCH_SIZE, exclude_ids=self.delivery_recorder.pending_job_ids())
+                if not jobs:
+                    return
+                jobs_by_listing: Dict[str, List[Dict]] = {}
+                for job in jobs:
+                    jobs_by_listing.setdefault(job['url_key'], []).append(job)
+                for url_key, listing_jobs in jobs_by_listing.items():
+                    try:
+                        await self._deliver_listing_jobs(url_key, listing_jobs)
+                    except Exception as e:
+                        # Незавершені завдання лишаються в 'sending' і повернуться після OUTBOX_LEASE_SECONDS
+                        logger.error(f"Failed to deliver {len(listing_jobs)} notifications for {url_key}: {e}")
+
+    async def fetch_json_data(self, page: int = 0) -> Optional[Dict]:
+        headers = {}
+        cached = self._api_cache.get(page)
+        if cached:
+            validators = cached[0]
+            if 'etag' in validators:
+                headers['If-None-Match'] = validators['etag']
+            if 'last-modified' in validators:
+                headers['If-Modified-Since'] = validators['last-modified']
+
+        for attempt in range(API_RETRIES + 1):
+            try:
+                response = await self.get_http_client().get(API_URL, params={'limit': API_PAGE_SIZE, 'page': page},
+                                                             headers=headers)
+                if response.status_code == 304 and cached:
+                    # Сторінка не змінилась з минулого запиту — віддаємо збережене тіло
+                    return cached[1]
+                response.raise_for_status()
+                data = response.json()
                 break
+            except (httpx.HTTPError, ValueError) as e:
+                # Тимчасові збої (тайм-аут, розрив, 429/5xx) повторюємо з експоненційною затримкою, решту — ні
+                retryable = isinstance(e, httpx.TransportError) or (
+                    isinstance(e, httpx.HTTPStatusError) and (e.response.status_code == 429
+                                                              or e.response.status_code >= 500))
+                reason = f"{type(e).__name__} {e}".strip()
+                if not retryable or attempt == API_RETRIES:
+                    logger.error(f"API request for page {page} failed: {reason}")
+                    return None
+                delay = API_RETRY_DELAY * 2 ** attempt
+                logger.warning(f"API request for page {page} failed ({reason}), retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
 
-            for item in data['data']:
-                url_key = item.get('urlKey')
-                if not url_key or self.db.is_url_processed(url_key):
-                    continue
-
-                image_url = (IMAGE_BASE_URL + uri) if (pictures := item.get('pictures', [])) and (
-                            uri := pictures[0].get('uri')) else None
-                house_addition = item.get('houseNumberAddition', '') or ''
+        validators = {k: response.headers[k] for k in ('etag', 'last-modified') if k in response.headers}
+        if validators:
+            self._api_cache[page] = (validators, data)
+        else:
+            self._api_cache.pop(page, None)
+        return data
+
+    @staticmethod
+    def _build_listing_data(item: Dict) -> Dict:
+        url_key = item['urlKey']
+        image_url = (IMAGE_BASE_URL + uri) if (pictures := item.get('pictures', [])) and (
+                    uri := pictures[0].get('uri')) else None
+        house_addition = item.get('houseNumberAddition', '') or ''
+
+        return {
+            'url_key': url_key, 'full_url': BASE_URL + url_key, 'postcode': item.get('postalcode'),
+            'city': item.get('gemeenteGeoLocatieNaam'), 'street': item.get('street'),
+            'houseNumber': f"{item.get('houseNumber', '')}{house_addition}",
+            'base_price': item.get('netRent'),
+            'publication_date': item.get('publicationDate'), 'closing_date': item.get('closingDate'),
+            'image_url': image_url
+        }
 
-                listing_data = {
-                    'url_key': url_key, 'full_url': BASE_URL + url_key, 'postcode': item.get('postalcode'),
-                    'city': item.get('gemeenteGeoLocatieNaam'), 'street': item.get('street'),
-                    'houseNumber': f"{item.get('houseNumber', '')}{house_addition}",
-                    'base_price': item.get('netRent'),
-                    'publication_date': item.get('publicationDate'), 'closing_date': item.get('closingDate'),
-                    'image_url': image_url
-                }
+    async def iter_api_pages(self):
+        """
+        Віддає сторінки API по порядку. Сторінка 0 завантажується першою (з неї відомий page_count),
+        наступні — паралельно вікнами по API_FETCH_CONCURRENCY, лише якщо споживач їх запитує.
+        """
+        first = await self.fetch_json_data(0)
+        if not first or not first.get('data'):
+            return
+        yield first
+
+        page_count = first.get('_metadata', {}).get('page_count', 1)
+        next_page = 1
+        while next_page < page_count:
+            window = range(next_page, min(page_count, next_page + API_FETCH_CONCURRENCY))
+            results = await asyncio.gather(*(self.fetch_json_data(page) for page in window))
+            for data in results:
+                if not data or not data.get('data'):
+                    return
+                yield data
+            next_page = window.stop
 
-                self.db.add_processed_url(**listing_data)
-                logger.info(f"Found new listing: {url_key}")
+    async def process_new_listings(self, context: ContextTypes.DEFAULT_TYPE):
+        logger.info("Starting new listings processing cycle.")
+        if not self.db.has_active_users():
+            logger.info("No active users, skipping processing cycle.")
+            return
 
-                for user in active_users:
-                    try:
-                        if await self.send_listing_message(user['user_id'], listing_data):
-                            self.db.add_sent_message(user['user_id'], url_key)
-                        await asyncio.sleep(0.1)  # Throttling
-                    except Exception as e:
-                        logger.error(f"Unhandled exception in user notification loop for user {user['user_id']}: {e}")
+        pages_read = found = 0
+        async for data in self.iter_api_pages():
+            pages_read += 1
+            items_by_key = {item['urlKey']: item for item in data['data'] if item.get('urlKey')}
+            new_keys = self.db.filter_new_url_keys(list(items_by_key))
+            if not new_keys:
+                # Стрічка впорядкована від новіших: повністю відома сторінка означає, що далі нових оголошень немає
+                break
 
+            new_listings = [self._build_listing_data(items_by_key[url_key]) for url_key in new_keys]
+            # Оголошення та сповіщення про них у outbox зберігаються атомарно ще до першої відправки
+            self.db.add_processed_urls(new_listings)
+            self._schedule_visibility_tick()
+            found += len(new_listings)
+            for listing_data in new_listings:
+                logger.info(f"Found new listing: {listing_data['url_key']}")
+        logger.info(f"Finished listings processing cycle ({pages_read} API pages read).")
+        if found:
+            # Розсилка йде окремою задачею: опитування API не чекає її завершення і не пропускає наступні цикли
+            self.job_queue.run_once(self.drain_outbox, 0)
+
+    def _on_listing_expiring_soon(self, listing: Dict):
+        logger.info(f"Listing {listing['url_key']} closes within {HIGHLIGHT_DAYS_THRESHOLD} days "
+                    f"({listing['closing_date']}).")
+
+    def _schedule_visibility_tick(self):
+        """Ставить разову задачу точно на найближчий перехід видимості (а не періодичне опитування)."""
+        next_at = self.db.visibility.next_transition()
+        if next_at is None:
+            return
+        job = self._visibility_job
+        if job is not None and not job.removed and job.next_t is not None and job.next_t <= next_at:
+            return
+        if job is not None and not job.removed:
+            job.schedule_removal()
+        self._visibility_job = self.job_queue.run_once(self._visibility_tick, when=next_at)
 
-            metadata = data.get('_metadata', {})
-            if metadata.get('page', 0) < metadata.get('page_count', 1) - 1:
-                page += 1
-                await asyncio.sleep(1)
-            else:
-                break
-        logger.info("Finished listings processing cycle.")
+    async def _visibility_tick(self, context: ContextTypes.DEFAULT_TYPE):
+        self._visibility_job = None
+        # Застосовуємо переходи, що вже настали (слухачі викликаються тут), і плануємо наступний
+        self.db.visibility.advance(datetime.now(timezone.utc))
+        self._schedule_visibility_tick()
 
-    def run(self):
-        logger.info("🚀 Starting WH Bot")
+    def _schedule_jobs(self):
         # Запускаємо основний процес
         self.job_queue.run_repeating(self.process_new_listings, interval=CHECK_INTERVAL, first=10)
         logger.info(f"Listings monitoring started with an interval of {CHECK_INTERVAL} seconds.")
+        # Доставка сповіщень з outbox: повтори після помилок і те, що не встигли надіслати до перезапуску
+        self.job_queue.run_repeating(self.drain_outbox, interval=OUTBOX_POLL_INTERVAL, first=5)
+        logger.info(f"Outbox delivery started with an interval of {OUTBOX_POLL_INTERVAL} seconds.")
+        self._schedule_visibility_tick()
         # Запускаємо процес перевірки здоров'я трекера
         self.job_queue.run_repeating(self.check_tracker_health, interval=TRACKER_HEALTH_CHECK_INTERVAL, first=5)
         logger.info(f"Tracker health check started with an interval of {TRACKER_HEALTH_CHECK_INTERVAL} seconds.")
-        
-        self.app.run_polling()
+
+    async def start_webhook(self):
+        """Запускає застосунок без Updater і реєструє вебхук у Telegram (викликається з lifespan трекера)."""
+        await self.app.initialize()
+        await self.app.start()
+        await self.app.bot.set_webhook(url=self.webhook_url, secret_token=self.webhook_secret_token,
+                                       allowed_updates=Update.ALL_TYPES,
+                                       max_connections=WEBHOOK_MAX_CONNECTIONS)
+        logger.info(f"Webhook registered at {self.webhook_url}")
+
+    async def stop_webhook(self):
+        # Вебхук не видаляємо: поки процес перезапускається, Telegram притримує оновлення у себе
+        await self.app.stop()
+        await self.app.shutdown()
+        await self._post_shutdown(self.app)
+
+    async def process_webhook_update(self, data: Dict) -> bool:
+        """Ставить оновлення з вебхука в чергу застосунку. Повертає False для некоректних даних."""
+        try:
+            update = Update.de_json(data, self.app.bot)
+        except Exception as e:
+            logger.warning(f"Failed to parse webhook update: {e}")
+            return False
+        if update is None:
+            return False
+        await self.app.update_queue.put(update)
+        return True
+
+    def run_webhook(self):
+        import uvicorn
+        import tracker
+
+        self.webhook_url = WEBHOOK_URL.rstrip('/') + tracker.TELEGRAM_WEBHOOK_PATH
+        # Без явно заданого секрету генеруємо випадковий: Telegram отримає його разом з set_webhook
+        self.webhook_secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        tracker.attach_telegram_bot(self, self.webhook_secret_token)
+        logger.info(f"Starting webhook server on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+        uvicorn.run(tracker.app, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT)
+
+    def run(self):
+        logger.info("🚀 Starting WH Bot")
+        requeued = self.db.recover_outbox()
+        if requeued:
+            logger.warning(f"Resuming {requeued} notifications interrupted by the previous shutdown.")
+        self._schedule_jobs()
+
+        if WEBHOOK_URL:
+            self.run_webhook()
+        else:
+            self.app.run_polling()
 
 
 if __name__ == "__main__":
@@ -766,5 +1551,5 @@ if __name__ == "__main__":
     if not PROVIDER_TOKEN:
         logger.warning("PROVIDER_TOKEN is not set! Donation feature will not work.")
 
-    bot = WHBot(TELEGRAM_BOT_TOKEN, DATABASE_PATH)
+    bot = WHBot(TELEGRAM_BOT_TOKEN, DATABASE_URL or DATABASE_PATH)
     bot.run()
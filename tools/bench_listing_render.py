@@ -0,0 +1,80 @@
+# tools/bench_listing_render.py
+"""
+Мікробенчмарк рендеру оголошення: попередній шлях (regex на кожен виклик escape + str.format
+шаблону з TRANSLATIONS) проти поточного (str.translate + шаблони, скомпільовані при імпорті).
+
+Запуск з кореня репозиторію:
+    python tools/bench_listing_render.py --number 20000
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_FILE_PATH", os.devnull)
+
+import main  # noqa: E402
+from formatting import escape_markdown_v2  # noqa: E402
+from i18n import TRANSLATIONS  # noqa: E402
+
+LISTING = {
+    'url_key': 'bench', 'full_url': 'https://example.test/bench', 'postcode': '5211 AB',
+    'city': "'s-Hertogenbosch", 'street': 'St. Janssingel', 'houseNumber': '12-A', 'base_price': 1234.56,
+    'publication_date': '2026-10-01T10:00:00Z', 'closing_date': '2026-10-20T08:30:00+00:00',
+}
+
+
+def legacy_escape_markdown_v2(text) -> str:
+    escape_chars = r'\_*[]()~`>#+-=|{}.!'
+    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', str(text))
+
+
+def legacy_translate(lang: str, key: str, **kwargs) -> str:
+    text = TRANSLATIONS.get(lang, {}).get(key)
+    if not text:
+        text = TRANSLATIONS['en'].get(key, f"_{key}_")
+    return text.format(**kwargs)
+
+
+def legacy_render(bot, lang, tz, listing):
+    not_specified_text = legacy_translate(lang, 'not_specified')
+    safe_address = {k: legacy_escape_markdown_v2(listing.get(k) or not_specified_text) for k in
+                    ['postcode', 'city', 'street', 'houseNumber']}
+    title = legacy_translate(lang, 'new_listing_title', **safe_address)
+    body_data = {
+        'base_price': legacy_escape_markdown_v2(listing.get('base_price') or not_specified_text),
+        'publication_date': legacy_escape_markdown_v2(bot.format_date(lang, tz, listing.get('publication_date'))),
+        'closing_date': legacy_escape_markdown_v2(bot.format_date(lang, tz, listing.get('closing_date'))),
+    }
+    return title, legacy_translate(lang, 'new_listing_body', **body_data)
+
+
+def bench(label: str, func, number: int):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{label:<28} {best / number * 1e6:8.2f} µs")
+    return best
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    bot = main.WHBot('0:bench', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    assert legacy_render(bot, 'uk', None, LISTING) == bot._render_listing_text('uk', None, LISTING)
+
+    field = LISTING['street']
+    before = bench("escape (regex), per field", lambda: legacy_escape_markdown_v2(field), args.number)
+    after = bench("escape (translate), per field", lambda: escape_markdown_v2(field), args.number)
+    print(f"{'':<28} x{before / after:.1f}")
+    before = bench("render (legacy), per listing", lambda: legacy_render(bot, 'uk', None, LISTING), args.number)
+    after = bench("render (current), per listing", lambda: bot._render_listing_text('uk', None, LISTING), args.number)
+    print(f"{'':<28} x{before / after:.1f}")
+    bot.db.close()
+
+
+if __name__ == "__main__":
+    run()
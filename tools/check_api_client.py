@@ -0,0 +1,209 @@
+# tools/check_api_client.py
+"""
+Перевірка клієнта API оголошень проти локального stub-сервера з повільними, "завислими" та збійними сторінками:
+event loop не блокується під час повільного запиту, тайм-аут спрацьовує, повтори з затримкою виконуються,
+304 віддає збережене тіло, а повністю відома сторінка 0 зупиняє пагінацію після одного запиту.
+
+Запуск з кореня репозиторію (нічого, крім залежностей бота, не потрібно):
+    python tools/check_api_client.py
+    python tools/check_api_client.py --timeout 2 --hang 6
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubApi(ThreadingHTTPServer):
+    """
+    Стрічка оголошень у форматі API: `pages` — списки urlKey по сторінках. `plan[page]` — черга дій для наступних
+    запитів цієї сторінки: 'slow' (відповідь із затримкою), 'hang' (довше за тайм-аут клієнта), '503'; далі — 'ok'.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, slow: float, hang: float):
+        super().__init__(('127.0.0.1', 0), StubApiHandler)
+        self.slow, self.hang = slow, hang
+        self.pages = []
+        self.plan = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/api"
+
+    def set_pages(self, pages):
+        with self.lock:
+            self.pages = [list(page) for page in pages]
+
+    def expect(self, page: int, *actions: str):
+        with self.lock:
+            self.plan.setdefault(page, deque()).extend(actions)
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.plan.clear()
+
+    def pages_requested(self):
+        with self.lock:
+            return [page for page, _ in self.requests]
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server: StubApi = self.server
+        page = int(parse_qs(urlparse(self.path).query).get('page', ['0'])[0])
+        with server.lock:
+            actions = server.plan.get(page)
+            action = actions.popleft() if actions else 'ok'
+            server.requests.append((page, action))
+            items = server.pages[page] if page < len(server.pages) else []
+            body = json.dumps({
+                'data': [{'urlKey': key, 'street': 'Stubstraat', 'houseNumber': n, 'postalcode': '5611AB',
+                          'gemeenteGeoLocatieNaam': 'Eindhoven', 'netRent': 900 + n}
+                         for n, key in enumerate(items)],
+                '_metadata': {'page_count': len(server.pages)},
+            }).encode()
+        if action == 'slow':
+            time.sleep(server.slow)
+        elif action == 'hang':
+            time.sleep(server.hang)
+        if action == '503':
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = f'"{hash(body) & 0xffffffff:x}"'
+        try:
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клієнт уже відключився за тайм-аутом
+            pass
+
+
+def check(condition: bool, label: str):
+    if not condition:
+        raise AssertionError(label)
+    print(f"  ok  {label}")
+
+
+async def timed(coroutine):
+    started = time.monotonic()
+    result = await coroutine
+    return result, time.monotonic() - started
+
+
+async def run_checks(main, stub: StubApi):
+    bot = main.WHBot('0:check', os.path.join(tempfile.mkdtemp(), 'check.db'))
+    bot.db.add_or_get_user(1, 'check', 'Check', 'en')
+    stub.set_pages([[f'check-{page}-{n}' for n in range(3)] for page in range(3)])
+    try:
+        stub.expect(0, 'slow')
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        data, elapsed = await timed(bot.fetch_json_data(0))
+        ticking.cancel()
+        check(data is not None and ticks >= int(elapsed / 0.02) // 2,
+              f"event loop kept running during a {elapsed:.2f}s response ({ticks} ticks)")
+
+        stub.reset()
+        stub.expect(1, 'hang')
+        data, elapsed = await timed(bot.fetch_json_data(1))
+        check(data is not None and stub.pages_requested() == [1, 1]
+              and elapsed >= main.API_TIMEOUT + main.API_RETRY_DELAY,
+              f"hung page timed out after {main.API_TIMEOUT}s and was retried with backoff ({elapsed:.2f}s)")
+
+        stub.reset()
+        stub.expect(2, '503')
+        data, _ = await timed(bot.fetch_json_data(2))
+        check(data is not None and stub.pages_requested() == [2, 2], "503 is retried")
+
+        stub.reset()
+        stub.expect(2, *['hang'] * (main.API_RETRIES + 1))
+        data, elapsed = await timed(bot.fetch_json_data(2))
+        budget = (main.API_RETRIES + 1) * main.API_TIMEOUT + main.API_RETRY_DELAY * (2 ** main.API_RETRIES - 1)
+        check(data is None and len(stub.pages_requested()) == main.API_RETRIES + 1 and elapsed < budget + 1.0,
+              f"page that never answers gives up after {main.API_RETRIES + 1} attempts ({elapsed:.2f}s)")
+
+        stub.reset()
+        first = await bot.fetch_json_data(0)
+        again = await bot.fetch_json_data(0)
+        check(again == first and len(stub.pages_requested()) == 2, "unchanged page served from cache on 304")
+
+        # Перший цикл бачить усі оголошення нові й читає всі сторінки, другий — лише сторінку 0
+        bot._api_cache.clear()
+        stub.reset()
+        await bot.process_new_listings(None)
+        check(sorted(set(stub.pages_requested())) == [0, 1, 2], "first cycle reads every page")
+        stub.reset()
+        await bot.process_new_listings(None)
+        check(stub.pages_requested() == [0], "known page 0 stops pagination after one request")
+
+        stub.reset()
+        stub.expect(1, *['hang'] * (main.API_RETRIES + 1))
+        stub.set_pages([['check-new'] + stub.pages[0]] + stub.pages[1:])
+        bot._api_cache.clear()
+        _, elapsed = await timed(bot.process_new_listings(None))
+        check(bot.db.filter_new_url_keys(['check-new']) == [] and elapsed < budget + 1.0,
+              f"hung page 1 ends the cycle, listings from page 0 kept ({elapsed:.2f}s)")
+    finally:
+        if bot.http_client is not None:
+            await bot.http_client.aclose()
+        bot.db.close()
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timeout', type=float, default=0.5, help='API_TIMEOUT клієнта, с')
+    parser.add_argument('--slow', type=float, default=0.3, help='затримка повільної відповіді (менша за тайм-аут)')
+    parser.add_argument('--hang', type=float, default=2.0, help='затримка "завислої" відповіді (більша за тайм-аут)')
+    args = parser.parse_args()
+
+    stub = StubApi(args.slow, args.hang)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    # Налаштування main.py читаються при імпорті
+    os.environ.update({'API_URL': stub.url, 'API_TIMEOUT': str(args.timeout), 'API_RETRIES': '2',
+                       'API_RETRY_DELAY': '0.1', 'API_FETCH_CONCURRENCY': '2'})
+    os.environ.setdefault("LOG_FILE_PATH", os.devnull)
+    import main
+    try:
+        asyncio.run(run_checks(main, stub))
+    finally:
+        stub.shutdown()
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    run()
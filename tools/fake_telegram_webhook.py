@@ -0,0 +1,80 @@
+# tools/fake_telegram_webhook.py
+"""
+Імітує Telegram: надсилає оновлення на вебхук бота паралельно та друкує коди відповідей і затримки.
+
+Запуск (бот має працювати в режимі вебхука, напр. `WEBHOOK_URL=https://... python main.py`):
+    python tools/fake_telegram_webhook.py --url http://127.0.0.1:8000 --secret <WEBHOOK_SECRET_TOKEN> \\
+        --users 20 --updates 5 --text /start
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+
+WEBHOOK_PATH = "/telegram/webhook"
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"Load{user_id}", 'language_code': 'uk'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else [],
+        },
+    }
+
+
+async def send_user_updates(client: httpx.AsyncClient, url: str, secret: str, user_id: int, count: int,
+                            text: str, first_update_id: int, statuses: Counter, latencies: list):
+    # Як і Telegram, оновлення одного чату надсилаються послідовно, різних чатів — паралельно
+    for i in range(count):
+        started = time.monotonic()
+        try:
+            response = await client.post(url, json=make_update(first_update_id + i, user_id, text),
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': secret})
+            statuses[response.status_code] += 1
+            latencies.append(time.monotonic() - started)
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--users', type=int, default=10, help='скільки різних чатів імітувати')
+    parser.add_argument('--updates', type=int, default=3, help='скільки оновлень надсилає кожен чат')
+    parser.add_argument('--user-id-base', type=int, default=900000000)
+    parser.add_argument('--text', default='/start')
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/') + WEBHOOK_PATH
+    statuses: Counter = Counter()
+    latencies: list = []
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        await asyncio.gather(*(
+            send_user_updates(client, url, args.secret, args.user_id_base + n, args.updates, args.text,
+                              n * args.updates + 1, statuses, latencies)
+            for n in range(args.users)
+        ))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    total = sum(statuses.values())
+    print(f"{total} updates in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+    print("statuses: " + ", ".join(f"{status}={n}" for status, n in sorted(statuses.items(), key=str)))
+    if latencies:
+        print(f"latency p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"max={latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
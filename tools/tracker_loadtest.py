@@ -0,0 +1,62 @@
+# tools/tracker_loadtest.py
+"""
+Навантажувальний тест редіректів трекера.
+
+Запуск (трекер має працювати локально, напр. `uvicorn tracker:app --port 8000`):
+    python tools/tracker_loadtest.py --url http://127.0.0.1:8000 --concurrency 100 --duration 10
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def worker(client: httpx.AsyncClient, url: str, deadline: float, worker_id: int, latencies: list,
+                 errors: list):
+    n = 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            response = await client.get(f"{url}/track", params={'user_id': worker_id, 'url_key': f"load-{n}"})
+            if response.status_code not in (302, 307):
+                errors.append(response.status_code)
+            else:
+                latencies.append(time.monotonic() - started)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        n += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0, follow_redirects=False) as client:
+        deadline = time.monotonic() + args.duration
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client, args.url, deadline, i, latencies, errors)
+                               for i in range(args.concurrency)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    print(f"redirects: {len(latencies)}  errors: {len(errors)}  elapsed: {elapsed:.1f}s")
+    print(f"throughput: {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency p50: {percentile(latencies, 50) * 1000:.1f} ms  "
+          f"p99: {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,18 +1,205 @@
 # tracker.py
-import sqlite3
+import asyncio
+import gzip
+import hashlib
+import hmac
 import os
 import logging
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import FastAPI, Request, Form, Header
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, Response
+
+try:
+    import brotli
+except ImportError:  # brotli необов'язковий: без нього віддаємо gzip
+    brotli = None
 from fastapi.middleware.cors import CORSMiddleware
 
+from storage import format_timestamp, open_storage
+
 # --- Налаштування ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 DATABASE_PATH = os.environ.get("DATABASE_PATH", "/var/lib/wh_bot/bot_database.db")
+# Те саме сховище, що й у бота: sqlite:///шлях або postgresql://...; якщо не задано — DATABASE_PATH
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
 BASE_URL = os.environ.get("BASE_URL", "https://www.woninghuren.nl/aanbod/te-huur/details/")
 
-app = FastAPI()
+# Кліки пишуться в БД пачками: коли набралось CLICK_BATCH_SIZE або минуло CLICK_FLUSH_INTERVAL секунд
+CLICK_BATCH_SIZE = int(os.environ.get("CLICK_BATCH_SIZE", "200"))
+CLICK_FLUSH_INTERVAL = float(os.environ.get("CLICK_FLUSH_INTERVAL", "1.0"))
+CLICK_FLUSH_RETRIES = 3
+
+# Скільки секунд браузер може кешувати сторінку /get_tz без перевірки
+TZ_PAGE_MAX_AGE = int(os.environ.get("TZ_PAGE_MAX_AGE", "86400"))
+
+# Шлях, на який Telegram надсилає оновлення, коли бот працює в режимі вебхука в цьому ж процесі
+TELEGRAM_WEBHOOK_PATH = "/telegram/webhook"
+
+
+class TrackerDatabase:
+    """
+    Одне довготривале з'єднання зі сховищем (SQLite або PostgreSQL) на весь сервіс. Усі запити виконуються
+    в одному виділеному потоці: з'єднання не ділиться між потоками, записи серіалізуються, а event loop не блокується.
+    """
+
+    def __init__(self, database_url: str):
+        self.storage = open_storage(database_url, timeout=25.0)
+        self._conn = None
+        self._executor: ThreadPoolExecutor = None
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tracker-db")
+        await self._run(self._connect)
+
+    async def close(self):
+        if self._executor is not None:
+            await self._run(self._conn.close)
+            self._executor.shutdown()
+            self._executor = None
+
+    def _connect(self):
+        self._conn = self.storage.connect()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _ensure_connection(self):
+        # Розірване з'єднання з PostgreSQL (перезапуск сервера) відкриваємо заново перед наступним запитом
+        if not self.storage.is_open(self._conn):
+            self._conn = self.storage.connect()
+
+    def _execute(self, query: str, params: tuple):
+        self._ensure_connection()
+        with self._conn:
+            self._conn.execute(query, params)
+
+    def _executemany(self, query: str, rows: list):
+        self._ensure_connection()
+        with self._conn:
+            self._conn.executemany(query, rows)
+
+    async def execute(self, query: str, params: tuple = ()) -> bool:
+        try:
+            await self._run(self._execute, query, params)
+            return True
+        except Exception as e:
+            logging.error(f"Помилка виконання запиту до БД: {e}")
+            return False
+
+    async def executemany(self, query: str, rows: list) -> bool:
+        """Виконує запит для багатьох рядків в одній транзакції. Повертає False, якщо запис не вдався."""
+        try:
+            await self._run(self._executemany, query, rows)
+            return True
+        except Exception as e:
+            logging.error(f"Помилка пакетного запису до БД ({len(rows)} рядків): {e}")
+            return False
+
+
+class ClickWriter:
+    """
+    Буфер кліків: /track лише кладе подію в чергу, а фонова задача пише їх у БД пачками.
+    stop() дописує все, що залишилось у черзі, тож при коректній зупинці кліки не губляться.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db: TrackerDatabase, batch_size: int, flush_interval: float):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._queue.put_nowait(self._STOP)
+            await self._task
+            self._task = None
+
+    def submit(self, user_id: int, url_key: str, user_agent: str):
+        # Час кліку фіксуємо одразу, а не в момент запису пачки (формат як у CURRENT_TIMESTAMP)
+        clicked_at = format_timestamp(datetime.now(timezone.utc))
+        self._queue.put_nowait((user_id, url_key, clicked_at, user_agent))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            # Перша подія пачки — без таймауту, щоб у простої задача просто спала
+            item = await self._queue.get()
+            batch = []
+            deadline = loop.time() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            if stopping:
+                # Дописуємо все, що встигло потрапити в чергу до зупинки
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not self._STOP:
+                        batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        for attempt in range(CLICK_FLUSH_RETRIES):
+            if await self.db.executemany(
+                'INSERT INTO url_clicks (user_id, url_key, clicked_at, user_agent) VALUES (?, ?, ?, ?)', batch
+            ):
+                return
+            await asyncio.sleep(0.5 * (attempt + 1))
+        logging.error(f"Не вдалося записати {len(batch)} кліків після {CLICK_FLUSH_RETRIES} спроб")
+
+
+tracker_db = TrackerDatabase(DATABASE_URL or DATABASE_PATH)
+click_writer = ClickWriter(tracker_db, CLICK_BATCH_SIZE, CLICK_FLUSH_INTERVAL)
+
+# Бот, підключений через attach_telegram_bot (режим вебхука); None — трекер працює окремо від бота
+telegram_bot = None
+telegram_secret_token = ""
+
+
+def attach_telegram_bot(bot, secret_token: str):
+    """
+    Підключає бота до цього ASGI-застосунку: він стартує й зупиняється разом із сервером,
+    а оновлення з TELEGRAM_WEBHOOK_PATH передаються в bot.process_webhook_update().
+    """
+    global telegram_bot, telegram_secret_token
+    telegram_bot = bot
+    telegram_secret_token = secret_token
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await tracker_db.open()
+    click_writer.start()
+    if telegram_bot is not None:
+        await telegram_bot.start_webhook()
+    yield
+    if telegram_bot is not None:
+        await telegram_bot.stop_webhook()
+    await click_writer.stop()
+    await tracker_db.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Додаємо CORS, щоб браузер дозволив POST-запит зі сторінки
 app.add_middleware(
@@ -23,97 +210,167 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def db_execute(query: str, params: tuple = ()):
-    """Утиліта для виконання запитів до БД з увімкненим WAL."""
-    try:
-        with sqlite3.connect(DATABASE_PATH, timeout=25.0) as conn:
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute(query, params)
-            conn.commit()
-    except Exception as e:
-        logging.error(f"Помилка виконання запиту до БД: {e}")
-
 @app.get("/track")
-def track_click(user_id: int, url_key: str, request: Request):
+async def track_click(user_id: int, url_key: str, request: Request):
     user_agent = request.headers.get('user-agent')
-    db_execute(
-        'INSERT INTO url_clicks (user_id, url_key, user_agent) VALUES (?, ?, ?)',
-        (user_id, url_key, user_agent)
-    )
+    # Редірект не чекає на SQLite: клік потрапляє в буфер і буде записаний фоновою задачею
+    click_writer.submit(user_id, url_key, user_agent)
     final_url = BASE_URL + url_key
     logging.info(f"Перенаправлення користувача {user_id} на {final_url}")
     return RedirectResponse(url=final_url)
 
-@app.get("/get_tz", response_class=HTMLResponse)
-def get_timezone_page(user_id: int):
-    # Ця HTML-сторінка буде показана користувачу в Telegram
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="uk">
-    <head>
-        <meta charset="UTF-8">
-        <meta name-viewport" content="width=device-width, initial-scale=1.0">
-        <title>Налаштування часового поясу</title>
-        <style>
-            body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; display: flex; justify-content: center; align-items: center; height: 100vh; margin: 0; background-color: #f0f2f5; text-align: center; }}
-            .container {{ padding: 20px; background-color: white; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.1); }}
-            #status {{ margin-top: 15px; font-weight: bold; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h2>Визначення часового поясу</h2>
-            <p>Зачекайте, ми автоматично визначаємо ваш часовий пояс...</p>
-            <p id="status">🤔 Визначаю...</p>
-        </div>
-        <script>
-            document.addEventListener('DOMContentLoaded', (event) => {{
-                const statusEl = document.getElementById('status');
-                try {{
-                    const userTimezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
-                    statusEl.textContent = `✅ Ваш часовий пояс: ${{userTimezone}}`;
-                    
-                    fetch('/set_tz', {{
-                        method: 'POST',
-                        headers: {{ 'Content-Type': 'application/x-www-form-urlencoded' }},
-                        body: `user_id={user_id}&timezone=${{encodeURIComponent(userTimezone)}}`
-                    }})
-                    .then(response => response.json())
-                    .then(data => {{
-                        if(data.status === 'ok') {{
-                            statusEl.innerHTML += '<br>✔️ Збережено! Можете закрити це вікно.';
-                        }} else {{
-                            statusEl.innerHTML += '<br>❌ Помилка збереження.';
-                        }}
-                    }})
-                    .catch(error => {{
-                        console.error('Error:', error);
-                        statusEl.innerHTML += '<br>❌ Не вдалося зв\\'язатися з сервером.';
-                    }});
-
-                }} catch (e) {{
-                    statusEl.textContent = '❌ Не вдалося визначити ваш часовий пояс.';
-                    console.error(e);
-                }}
-            }});
-        </script>
-    </body>
-    </html>
+# Ця HTML-сторінка буде показана користувачу в Telegram. Вона статична (user_id читається в браузері),
+# тому рендериться й стискається один раз при старті.
+TIMEZONE_PAGE_HTML = """<!DOCTYPE html>
+<html lang="uk">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Налаштування часового поясу</title>
+    <style>
+        body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; display: flex; justify-content: center; align-items: center; height: 100vh; margin: 0; background-color: #f0f2f5; text-align: center; }
+        .container { padding: 20px; background-color: white; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.1); }
+        #status { margin-top: 15px; font-weight: bold; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h2>Визначення часового поясу</h2>
+        <p>Зачекайте, ми автоматично визначаємо ваш часовий пояс...</p>
+        <p id="status">🤔 Визначаю...</p>
+    </div>
+    <script>
+        document.addEventListener('DOMContentLoaded', (event) => {
+            const statusEl = document.getElementById('status');
+            // user_id береться з query string, тож сама сторінка однакова для всіх і кешується
+            const userId = new URLSearchParams(window.location.search).get('user_id');
+            if (!userId) {
+                statusEl.textContent = '❌ Не вказано користувача.';
+                return;
+            }
+            try {
+                const userTimezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
+                statusEl.textContent = `✅ Ваш часовий пояс: ${userTimezone}`;
+                
+                fetch('/set_tz', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+                    body: `user_id=${encodeURIComponent(userId)}&timezone=${encodeURIComponent(userTimezone)}`
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if(data.status === 'ok') {
+                        statusEl.innerHTML += '<br>✔️ Збережено! Можете закрити це вікно.';
+                    } else {
+                        statusEl.innerHTML += '<br>❌ Помилка збереження.';
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    statusEl.innerHTML += '<br>❌ Не вдалося зв\\'язатися з сервером.';
+                });
+
+            } catch (e) {
+                statusEl.textContent = '❌ Не вдалося визначити ваш часовий пояс.';
+                console.error(e);
+            }
+        });
+    </script>
+</body>
+</html>
+"""
+
+
+def parse_accept_encoding(header: str) -> set:
+    """Множина кодувань з Accept-Encoding, крім явно заборонених через q=0."""
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if name and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Слабке порівняння If-None-Match (RFC 9110): префікс W/ ігнорується, '*' збігається з будь-яким."""
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+class PrecompressedPage:
     """
-    return HTMLResponse(content=html_content)
+    Статична сторінка: тіло, заздалегідь стиснені варіанти (gzip, brotli — якщо встановлено) та ETag.
+    Байти варіантів різні, тож і сильні ETag у них різні: "<хеш>", "<хеш>-gzip", "<хеш>-br".
+    """
+
+    def __init__(self, html: str, max_age: int):
+        self.body = html.encode('utf-8')
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.cache_control = f"public, max-age={max_age}"
+        # encoding -> (тіло, ETag); None — нестиснене тіло
+        self.variants = {None: (self.body, f'"{digest}"'),
+                         'gzip': (gzip.compress(self.body, compresslevel=9), f'"{digest}-gzip"')}
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(self.body, quality=11), f'"{digest}-br"')
+
+    def select_encoding(self, accept_encoding: str) -> Optional[str]:
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return None
+
+    def response(self, request: Request) -> Response:
+        encoding = self.select_encoding(request.headers.get('accept-encoding', ''))
+        body, etag = self.variants[encoding]
+        headers = {'ETag': etag, 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+        if etag_matches(request.headers.get('if-none-match', ''), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+timezone_page = PrecompressedPage(TIMEZONE_PAGE_HTML, TZ_PAGE_MAX_AGE)
+
+
+@app.get("/get_tz", response_class=HTMLResponse)
+async def get_timezone_page(request: Request):
+    return timezone_page.response(request)
 
 @app.post("/set_tz")
-def set_timezone(user_id: int = Form(...), timezone: str = Form(...)):
+async def set_timezone(user_id: int = Form(...), timezone: str = Form(...)):
     if not user_id or not timezone:
         return JSONResponse(status_code=400, content={"status": "error", "message": "Missing user_id or timezone"})
 
     logging.info(f"Встановлення часового поясу '{timezone}' для користувача {user_id}")
-    db_execute(
+    await tracker_db.execute(
         "UPDATE users SET timezone = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
         (timezone, user_id)
     )
     return JSONResponse(content={"status": "ok"})
 
+@app.post(TELEGRAM_WEBHOOK_PATH)
+async def telegram_webhook(request: Request,
+                           x_telegram_bot_api_secret_token: str = Header(default="")):
+    if telegram_bot is None:
+        return Response(status_code=404)
+    if not hmac.compare_digest(x_telegram_bot_api_secret_token.encode(), telegram_secret_token.encode()):
+        logging.warning(f"Відхилено запит на вебхук з невірним секретом від {request.client.host if request.client else '?'}")
+        return Response(status_code=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return Response(status_code=400)
+    # Оновлення лише ставиться в чергу бота, тож Telegram отримує відповідь одразу,
+    # а паралельні запити вебхука не чекають один на одного
+    if not await telegram_bot.process_webhook_update(data):
+        return Response(status_code=400)
+    return Response(status_code=200)
+
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "ok"}
\ No newline at end of file
@@ -0,0 +1,66 @@
+# update_processor.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Ліміт семафора BaseUpdateProcessor: той семафор береться ще до черги користувача, тож реальний
+# ліміт одночасної обробки тримає власний семафор процесора, який береться вже після блокування користувача
+_UNBOUNDED = 2 ** 31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обробляє оновлення паралельно (не більше `max_concurrent_updates` одночасно),
+    але оновлення одного користувача — строго по черзі, в порядку надходження.
+    Оновлення, що чекають у черзі свого користувача, слот не займають, тож один користувач
+    з повільним обробником не блокує решту.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(_UNBOUNDED)
+        self._slots = asyncio.Semaphore(max(1, max_concurrent_updates))
+        # user_id -> [lock, кількість оновлень, що його тримають або чекають]
+        self._user_locks: Dict[int, List[Any]] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock віддається чекаючим у порядку FIFO, тож порядок оновлень користувача зберігається
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._user_locks:
+            logger.warning(f"Update processor shut down with {len(self._user_locks)} users still in flight.")
+        self._user_locks.clear()
@@ -0,0 +1,164 @@
+# visibility.py
+import heapq
+import itertools
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Ключ сортування для відсутньої дати: як NULL у SQLite — першим при ASC, останнім при DESC
+_MISSING = datetime.min.replace(tzinfo=timezone.utc)
+
+_RECENT_END, _ACTIVE_END, _EXPIRING_SOON = 'recent_end', 'active_end', 'expiring_soon'
+
+
+class ListingVisibilityIndex:
+    """
+    Оголошення переглядів 'recent' (опубліковані за останні `recent_days`) та 'active' (ще не закриті) у пам'яті.
+
+    Для кожного перегляду тримаються відсортовані списки (дата, id) за publication_date і closing_date,
+    а моменти, коли оголошення виходить з перегляду або стає "скоро закінчується", — у купі подій.
+    advance(now) обробляє лише події, що вже настали, тож сторінки й лічильники не потребують
+    ні сканування, ні запитів до БД. `version` змінюється при кожній зміні складу переглядів.
+    """
+
+    def __init__(self, recent_days: int, expiring_window: timedelta,
+                 parse_datetime: Callable[[str], datetime]):
+        self.recent_window = timedelta(days=recent_days)
+        self.expiring_window = expiring_window
+        self._parse = parse_datetime
+        self.version = 0
+        self._rows: Dict[int, Dict] = {}
+        # id -> перегляди, в яких оголошення зараз видно; рядок тримається, поки множина не порожня
+        self._views_of: Dict[int, set] = {}
+        # id -> (publication, closing); лишається і після виходу з переглядів — для курсорів старих сторінок
+        self._keys: Dict[int, Tuple[datetime, datetime]] = {}
+        self._orders: Dict[Tuple[str, str], List[Tuple[datetime, int]]] = {
+            (view, sort_order): [] for view in ('recent', 'active') for sort_order in ('newest', 'closing')
+        }
+        # Активні оголошення, до закриття яких лишилось менше expiring_window
+        self._expiring: set = set()
+        self._events: List[Tuple[datetime, int, str, int]] = []
+        self._seq = itertools.count()
+        self._expiring_soon_listeners: List[Callable[[Dict], None]] = []
+
+    def on_expiring_soon(self, listener: Callable[[Dict], None]):
+        """`listener(row)` викликається, коли до closing_date оголошення лишається менше `expiring_window`."""
+        self._expiring_soon_listeners.append(listener)
+
+    def _to_datetime(self, value: Optional[str]) -> Optional[datetime]:
+        if not value:
+            return None
+        try:
+            dt = self._parse(value)
+        except (ValueError, TypeError):
+            return None
+        return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+    def _push(self, at: datetime, kind: str, listing_id: int):
+        heapq.heappush(self._events, (at, next(self._seq), kind, listing_id))
+
+    def add(self, rows: Iterable[Dict], now: datetime):
+        changed = False
+        for row in rows:
+            listing_id = row['id']
+            if listing_id in self._keys:
+                continue
+            published = self._to_datetime(row.get('publication_date'))
+            closing = self._to_datetime(row.get('closing_date'))
+            keys = (published or _MISSING, closing or _MISSING)
+            self._keys[listing_id] = keys
+            if published and published + self.recent_window >= now:
+                self._insert('recent', keys, listing_id)
+                self._push(published + self.recent_window, _RECENT_END, listing_id)
+            if closing and closing > now:
+                self._insert('active', keys, listing_id)
+                self._push(closing, _ACTIVE_END, listing_id)
+                if closing - self.expiring_window > now:
+                    self._push(closing - self.expiring_window, _EXPIRING_SOON, listing_id)
+                else:
+                    self._expiring.add(listing_id)
+            if listing_id in self._views_of:
+                self._rows[listing_id] = row
+                changed = True
+        if changed:
+            self.version += 1
+
+    def _insert(self, view: str, keys: Tuple[datetime, datetime], listing_id: int):
+        insort(self._orders[(view, 'newest')], (keys[0], listing_id))
+        insort(self._orders[(view, 'closing')], (keys[1], listing_id))
+        self._views_of.setdefault(listing_id, set()).add(view)
+
+    def _remove(self, view: str, listing_id: int):
+        keys = self._keys[listing_id]
+        for sort_order, key in (('newest', keys[0]), ('closing', keys[1])):
+            order = self._orders[(view, sort_order)]
+            pos = bisect_left(order, (key, listing_id))
+            if pos < len(order) and order[pos] == (key, listing_id):
+                del order[pos]
+        views = self._views_of[listing_id]
+        views.discard(view)
+        if not views:
+            del self._views_of[listing_id]
+            del self._rows[listing_id]
+
+    def advance(self, now: datetime) -> bool:
+        """Застосовує всі переходи з моментом <= now. Повертає True, якщо склад переглядів змінився."""
+        changed = False
+        while self._events and self._events[0][0] <= now:
+            _, _, kind, listing_id = heapq.heappop(self._events)
+            row = self._rows.get(listing_id)
+            if row is None:
+                continue
+            if kind == _EXPIRING_SOON:
+                self._expiring.add(listing_id)
+                for listener in self._expiring_soon_listeners:
+                    listener(row)
+            else:
+                if kind == _ACTIVE_END:
+                    self._expiring.discard(listing_id)
+                self._remove('recent' if kind == _RECENT_END else 'active', listing_id)
+            changed = True
+        if changed:
+            self.version += 1
+        return changed
+
+    def is_expiring_soon(self, listing_id: int) -> bool:
+        return listing_id in self._expiring
+
+    def next_transition(self) -> Optional[datetime]:
+        return self._events[0][0] if self._events else None
+
+    def count(self, view: str) -> int:
+        order = self._orders.get((view, 'newest'))
+        return len(order) if order is not None else 0
+
+    def page(self, view: str, sort_order: str, limit: int, offset: int = 0,
+             after_id: Optional[int] = None, before_id: Optional[int] = None) -> List[Dict]:
+        """Та сама семантика, що й у SQL-версії: сортування newest — за publication_date DESC, closing — ASC."""
+        sort_order = 'closing' if sort_order == 'closing' else 'newest'
+        order = self._orders.get((view, sort_order))
+        if order is None:
+            return []
+        descending = sort_order == 'newest'
+        anchor_id = after_id if after_id is not None else before_id
+        if anchor_id is not None:
+            keys = self._keys.get(anchor_id)
+            if keys is None:
+                return []
+            anchor = (keys[0] if descending else keys[1], anchor_id)
+            lo, hi = bisect_left(order, anchor), bisect_right(order, anchor)
+            forward = after_id is not None
+            if descending == forward:
+                # Елементи "перед" якорем у фізичному (зростаючому) порядку
+                selected = order[max(0, lo - limit):lo]
+            else:
+                selected = order[hi:hi + limit]
+        else:
+            if descending:
+                end = len(order) - offset
+                selected = order[max(0, end - limit):end] if end > 0 else []
+            else:
+                selected = order[offset:offset + limit]
+        if descending:
+            selected = selected[::-1]
+        return [self._rows[listing_id] for _, listing_id in selected]